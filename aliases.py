@@ -0,0 +1,96 @@
+from collections import deque
+
+
+class AliasMatcher:
+    # Aho-Corasick automaton over every alias in a character table. Each
+    # alias is tagged with the row rank of its character so ties at the same
+    # position resolve to the earlier row, like the iterrows loop did.
+
+    def __init__(self, characters):
+        self.names = []
+        self.aliases = []
+        self.goto = [{}]
+        self.fail = [0]
+        # longest alias ending at each node (directly or via suffix links)
+        # and the rank of the earliest character owning an alias that long
+        self.best = [None]
+        self.max_length = 0
+        self.empty_rank = None
+
+        for rank, (main_name, aliases) in enumerate(zip(characters['Main Name'], characters['Aliases'])):
+            self.names.append(main_name)
+            self.aliases.append(aliases)
+            for alias in aliases:
+                self.add(alias, rank)
+        self.link()
+
+    def add(self, alias, rank):
+        if alias == '':
+            # str.find('') is 0, so an empty alias matches every string
+            if self.empty_rank is None:
+                self.empty_rank = rank
+            return
+        node = 0
+        for char in alias:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.best.append(None)
+            node = child
+        candidate = (len(alias), -rank)
+        if self.best[node] is None or candidate > self.best[node]:
+            self.best[node] = candidate
+        self.max_length = max(self.max_length, len(alias))
+
+    def link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                inherited = self.best[self.fail[child]]
+                if inherited is not None and (self.best[child] is None or inherited > self.best[child]):
+                    self.best[child] = inherited
+                queue.append(child)
+
+    def earliest_rank(self, text):
+        if self.empty_rank is not None:
+            # every other alias can at best tie at position 0
+            return min([self.empty_rank, *self.ranks_at_start(text)])
+
+        best_start = best_rank = None
+        node = 0
+        for index, char in enumerate(text):
+            if best_start is not None and index - self.max_length + 1 > best_start:
+                break
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            match = self.best[node]
+            if match is None:
+                continue
+            length, negative_rank = match
+            start = index - length + 1
+            if best_start is None or (start, -negative_rank) < (best_start, best_rank):
+                best_start, best_rank = start, -negative_rank
+        return best_rank
+
+    def ranks_at_start(self, text):
+        # ranks of characters with an alias that is a prefix of text
+        node = 0
+        for depth, char in enumerate(text[:self.max_length], 1):
+            node = self.goto[node].get(char)
+            if node is None:
+                return
+            if self.best[node] is not None and self.best[node][0] == depth:
+                yield -self.best[node][1]
+
+    def earliest(self, text):
+        rank = self.earliest_rank(text)
+        return '' if rank is None else self.names[rank]
@@ -1,44 +1,110 @@
 import pandas as pd
+import numpy as np
 import ast
+import glob
+import hashlib
+import os
+import pickle
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from aliases import AliasMatcher
+import instrumentation
 
+# Parsed quotation_info/character_info for one novel. characters is the
+# compiled AliasMatcher, which the metrics accept in place of the raw table.
+Reference = namedtuple('Reference', ['quote_info', 'characters'])
 
-def earliest_alias(df, inferred_speaker):
-    earliest_name = ''
-    earliest_index = float('inf')
+references = {}
+
+QUOTE_TYPES = ['Anaphoric', 'Implicit', 'Explicit']
+
+
+def earliest_alias(characters, inferred_speaker):
+    # characters is either the character_info table or a prebuilt AliasMatcher
     if isinstance(inferred_speaker, float):
         return ''
+    if not isinstance(characters, AliasMatcher):
+        characters = AliasMatcher(characters)
+    return characters.earliest(inferred_speaker)
+
 
-    for index, row in df.iterrows():
-        main_name = row['Main Name']
-        aliases = row['Aliases']
+def file_stamp(path):
+    stat = os.stat(path)
+    with open(path, 'rb') as source:
+        digest = hashlib.sha1(source.read()).hexdigest()
+    return stat.st_mtime_ns, stat.st_size, digest
 
-        for alias in aliases:
-            alias_index = inferred_speaker.find(alias)
-            if alias_index != -1 and alias_index < earliest_index:
-                earliest_name = main_name
-                earliest_index = alias_index
 
-    return earliest_name
+def stamps_match(saved, path):
+    stat = os.stat(path)
+    if saved[:2] == (stat.st_mtime_ns, stat.st_size):
+        return True
+    return saved[2] == file_stamp(path)[2]
 
 
-def analyze(results_path, quotes_path, character_path, metric):
-    # Read the CSV files
-    results = pd.read_csv(results_path)
-    quote_info = pd.read_csv(quotes_path)
+def read_reference(quotes_path, character_path):
+    quote_info = pd.read_csv(quotes_path, usecols=['speaker', 'quoteType'])
     characters = pd.read_csv(character_path)
     characters['Aliases'] = characters['Aliases'].apply(ast.literal_eval)
+    return Reference(quote_info, AliasMatcher(characters))
+
+
+def load_reference(quotes_path, character_path, cache_path=None):
+    # Loaded once per process and reloaded when either source file changes;
+    # with cache_path the parsed tables are also pickled to disk and reused
+    # across processes until then.
+    key = (os.path.abspath(quotes_path), os.path.abspath(character_path))
+    if key in references:
+        stamps, reference = references[key]
+        if stamps_match(stamps[0], quotes_path) and stamps_match(stamps[1], character_path):
+            return reference
+
+    reference = None
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as cache:
+            stamps, cached = pickle.load(cache)
+        if stamps_match(stamps[0], quotes_path) and stamps_match(stamps[1], character_path):
+            reference = cached
+
+    if reference is None:
+        stamps = (file_stamp(quotes_path), file_stamp(character_path))
+        reference = read_reference(quotes_path, character_path)
+        if cache_path is not None:
+            with open(cache_path, 'wb') as cache:
+                pickle.dump((stamps, reference), cache, protocol=pickle.HIGHEST_PROTOCOL)
+
+    references[key] = (stamps, reference)
+    return reference
+
+
+def score_table(results_path, quotes_path, character_path, metric, reference=None, cache_path=None):
+    # the per-quote table with the metric's 'correct' column; a given
+    # reference is used in place of quotes_path and character_path
+    if reference is None:
+        reference = load_reference(quotes_path, character_path, cache_path)
+    quote_info = reference.quote_info
+    characters = reference.characters
+
+    with instrumentation.stage('analyze', results=results_path):
+        results = pd.read_csv(results_path)
+
+        # Determine the length of the shorter dataframe
+        min_length = min(len(results), len(quote_info))
+        # Truncate the longer dataframe
+        results = results.iloc[:min_length]
+        quote_info = quote_info.iloc[:min_length]
+        results_info = pd.concat([results, quote_info], axis=1)
+        instrumentation.count('generations_scored', min_length)
 
-    # Determine the length of the shorter dataframe
-    min_length = min(len(results), len(quote_info))
-    # Truncate the longer dataframe
-    results = results.iloc[:min_length]
-    quote_info = quote_info.iloc[:min_length]
-    results_info = pd.concat([results, quote_info], axis=1)
+        return metric(characters, results_info)
 
-    table = metric(characters, results_info)
 
-    # return results_info
+def analyze(results_path, quotes_path, character_path, metric, reference=None, cache_path=None):
+    return count_correct(score_table(results_path, quotes_path, character_path, metric, reference, cache_path))
 
+
+def count_correct(table):
     count_alias_present = table['correct'].sum()
     total_count = table.shape[0]
     anaphoric_correct_count = (
@@ -53,394 +119,157 @@ def analyze(results_path, quotes_path, character_path, metric):
     return count_alias_present, total_count, anaphoric_correct_count, anaphoric_count, implicit_correct_count, implicit_count, explicit_correct_count, explicit_count
 
 
+def earliest_aliases(matcher, inferred_speakers):
+    # score each distinct generation once; NaN outputs factorize to -1,
+    # which indexes the trailing '' like the isinstance(..., float) check
+    codes, uniques = pd.factorize(pd.Series(inferred_speakers, dtype=object))
+    names = [earliest_alias(matcher, inferred_speaker) for inferred_speaker in uniques]
+    instrumentation.count('alias_scans', len(uniques))
+    return np.array(names + [''], dtype=object)[codes]
+
+
+def strong_correct(matcher, inferred_speakers, speakers):
+    return earliest_aliases(matcher, inferred_speakers) == np.asarray(speakers, dtype=object)
+
+
+def weak_correct(characters, inferred_speakers, speakers):
+    if not isinstance(characters, AliasMatcher):
+        characters = AliasMatcher(characters)
+    inferred_speakers = pd.Series(inferred_speakers, dtype=object).reset_index(drop=True)
+    speakers = np.asarray(speakers, dtype=object)
+    has_text = ~inferred_speakers.map(lambda inferred_speaker: isinstance(inferred_speaker, float)).to_numpy(bool)
+
+    correct = np.zeros(len(inferred_speakers), dtype=bool)
+    for main_name, aliases in zip(characters.names, characters.aliases):
+        rows = has_text & (speakers == main_name)
+        if aliases and rows.any():
+            pattern = '|'.join(re.escape(alias) for alias in aliases)
+            correct[rows] = inferred_speakers[rows].str.contains(pattern, regex=True).to_numpy(bool)
+            instrumentation.count('alias_comparisons', int(rows.sum()) * len(aliases))
+    return correct
+
+
 def strong_metric(characters, results_info):
+    if not isinstance(characters, AliasMatcher):
+        characters = AliasMatcher(characters)
     results_info_copy = results_info.copy()
-    results_info_copy['correct'] = results_info_copy.apply(
-        lambda row: earliest_alias(characters, row['inferred_speaker']) == row['speaker'], axis=1)
+    results_info_copy['correct'] = strong_correct(
+        characters, results_info_copy['inferred_speaker'], results_info_copy['speaker'])
     return results_info_copy
 
 
 def weak_metric(characters, results_info):
-    # Append the columns together
-    results_info_character = pd.merge(results_info, characters, left_on='speaker', right_on='Main Name', how='left')
-    f = lambda row: any(not isinstance(row['inferred_speaker'], float) and alias in row['inferred_speaker'] for alias in row['Aliases'])
-    results_info_character['correct'] = results_info_character.apply(f, axis=1)
+    results_info_copy = results_info.copy()
+    results_info_copy['correct'] = weak_correct(
+        characters, results_info_copy['inferred_speaker'], results_info_copy['speaker'])
+    return results_info_copy
 
-    return results_info_character
 
+def discover_results(root='.'):
+    # every context<k>/<model>/<novel>.csv under root
+    cells = []
+    for path in glob.glob(os.path.join(root, 'context*', '*', '*.csv')):
+        context_dir, model, filename = os.path.normpath(path).split(os.sep)[-3:]
+        match = re.fullmatch(r'context(\d+)', context_dir)
+        if match is not None:
+            cells.append((os.path.splitext(filename)[0], model, int(match.group(1)), path))
+    return sorted(cells)
+
+
+def score_cell(cell):
+    novel, model, context, results_path, quotes_path, character_path, metric, cache_path = cell
+    counts = [int(count) for count in analyze(results_path, quotes_path, character_path, metric,
+                                              cache_path=cache_path)]
+    rows = []
+    for quote_type, (correct, total) in zip(['All'] + QUOTE_TYPES, zip(counts[::2], counts[1::2])):
+        rows.append({'novel': novel, 'model': model, 'context': context, 'quoteType': quote_type,
+                     'correct': correct, 'total': total})
+    return rows
+
+
+def run_grid(root='.', metric=strong_metric, processes=None, state_path=None, cache_path=None):
+    # Scores every result file across a process pool into one long table with
+    # a row per (novel, model, context, quoteType). With state_path, previous
+    # scores are reused for result files whose contents and reference files
+    # have not changed; rows of other metrics are kept. cache_path,
+    # e.g. 'cache/{}.pkl', is filled in with the novel and passed to
+    # load_reference, so workers share the parsed reference tables.
+    cells = discover_results(root)
+    state = previous = None
+    if state_path is not None and os.path.exists(state_path):
+        state = pd.read_csv(state_path)
+        previous = state[state['metric'] == metric.__name__]
+
+    # sha1 of the quotation_info and character_info digests of each novel
+    reference_digests = {}
+    for novel in sorted({cell[0] for cell in cells}):
+        digests = [file_stamp(os.path.join(root, novel, name))[2]
+                   for name in ['quotation_info.csv', 'character_info.csv']]
+        reference_digests[novel] = hashlib.sha1(' '.join(digests).encode()).hexdigest()
+
+    reused = []
+    jobs = []
+    for novel, model, context, results_path in cells:
+        saved = None
+        if previous is not None and 'reference' in previous:
+            saved = previous[(previous['path'] == results_path) &
+                             (previous['reference'] == reference_digests[novel])]
+        if saved is not None and len(saved) and stamps_match(
+                (saved['mtime_ns'].iloc[0], saved['size'].iloc[0], saved['sha1'].iloc[0]), results_path):
+            # a touched but unchanged file matched on its sha1; saving its
+            # new mtime spares the next run from hashing it again
+            stat = os.stat(results_path)
+            reused.append(saved.assign(mtime_ns=stat.st_mtime_ns, size=stat.st_size))
+        else:
+            jobs.append((novel, model, context, results_path,
+                         os.path.join(root, novel, 'quotation_info.csv'),
+                         os.path.join(root, novel, 'character_info.csv'),
+                         metric,
+                         None if cache_path is None else cache_path.format(novel)))
+
+    scored = []
+    if jobs:
+        with ProcessPoolExecutor(processes) as pool:
+            for job, rows in zip(jobs, pool.map(score_cell, jobs)):
+                mtime_ns, size, sha1 = file_stamp(job[3])
+                for row in rows:
+                    row.update({'metric': metric.__name__, 'path': job[3],
+                                'mtime_ns': mtime_ns, 'size': size, 'sha1': sha1,
+                                'reference': reference_digests[job[0]]})
+                scored.append(pd.DataFrame(rows))
+
+    grid = pd.concat(reused + scored, ignore_index=True)
+    grid = grid.sort_values(['novel', 'model', 'context'], kind='stable', ignore_index=True)
+    if state_path is not None:
+        others = [] if state is None else [state[state['metric'] != metric.__name__]]
+        pd.concat(others + [grid], ignore_index=True).to_csv(state_path, index=False)
+    return grid[['novel', 'model', 'context', 'quoteType', 'correct', 'total']]
+
+
+def accuracy_table(grid):
+    # pools the novels and returns accuracy (%) per model, context and quoteType
+    table = grid.groupby(['model', 'context', 'quoteType'], as_index=False)[['correct', 'total']].sum()
+    table['accuracy'] = table['correct'] / table['total'] * 100
+    return table
 
-def main():
-    pp_paths = [('context0/Mistral 7b NO INST/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context1/Mistral 7b NO INST/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context2/Mistral 7b NO INST/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context4/Mistral 7b NO INST/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context8/Mistral 7b NO INST/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context16/Mistral 7b NO INST/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv')
-                ]
-    emma_paths = [('context0/Mistral 7b NO INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context1/Mistral 7b NO INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context2/Mistral 7b NO INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context4/Mistral 7b NO INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context8/Mistral 7b NO INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context16/Mistral 7b NO INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv')
-                  ]
-
-    context = [0, 1, 2, 4, 8, 16]
-    total_acc = []
-    anaphoric_acc = []
-    implicit_acc = []
-    explicit_acc = []
-    for c, pp, emma in zip(context, pp_paths, emma_paths):
-        count_alias_present_pp, \
-            total_count_pp, \
-            anaphoric_correct_count_pp, \
-            anaphoric_count_pp, \
-            implicit_correct_count_pp, \
-            implicit_count_pp, \
-            explicit_correct_count_pp, \
-            explicit_count_pp = analyze(*pp, strong_metric)
-
-        count_alias_present_emma, \
-            total_count_emma, \
-            anaphoric_correct_count_emma, \
-            anaphoric_count_emma, \
-            implicit_correct_count_emma, \
-            implicit_count_emma, \
-            explicit_correct_count_emma, \
-            explicit_count_emma = analyze(*emma, strong_metric)
-        total = total_count_pp + total_count_emma
-        anaphoric_count = anaphoric_count_pp + anaphoric_count_emma
-        implicit_count = implicit_count_pp + implicit_count_emma
-        explicit_count = explicit_count_pp + explicit_count_emma
-
-        total_correct_count = count_alias_present_pp + count_alias_present_emma
-        anaphoric_correct_count = anaphoric_correct_count_pp + anaphoric_correct_count_emma
-        implicit_correct_count = implicit_correct_count_pp + implicit_correct_count_emma
-        explicit_correct_count = explicit_correct_count_pp + explicit_correct_count_emma
-
-        total_acc.append(total_correct_count / total * 100)
-        anaphoric_acc.append(anaphoric_correct_count / anaphoric_count * 100)
-        implicit_acc.append(implicit_correct_count / implicit_count * 100)
-        explicit_acc.append(explicit_correct_count / explicit_count * 100)
-
-    formatted_list = ["{:.1f}".format(num) for num in total_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in anaphoric_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in implicit_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in explicit_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-    print()
-
-    pp_paths = [('context0/Mistral 7b INST/PrideAndPrejudice.csv',
-            'PrideAndPrejudice/quotation_info.csv',
-            'PrideAndPrejudice/character_info.csv'),
-             ('context1/Mistral 7b INST/PrideAndPrejudice.csv',
-              'PrideAndPrejudice/quotation_info.csv',
-              'PrideAndPrejudice/character_info.csv'),
-             ('context2/Mistral 7b INST/PrideAndPrejudice.csv',
-              'PrideAndPrejudice/quotation_info.csv',
-              'PrideAndPrejudice/character_info.csv'),
-             ('context4/Mistral 7b INST/PrideAndPrejudice.csv',
-              'PrideAndPrejudice/quotation_info.csv',
-              'PrideAndPrejudice/character_info.csv'),
-             ('context8/Mistral 7b INST/PrideAndPrejudice.csv',
-              'PrideAndPrejudice/quotation_info.csv',
-              'PrideAndPrejudice/character_info.csv'),
-             ('context16/Mistral 7b INST/PrideAndPrejudice.csv',
-              'PrideAndPrejudice/quotation_info.csv',
-              'PrideAndPrejudice/character_info.csv')
-             ]
-    emma_paths = [('context0/Mistral 7b INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context1/Mistral 7b INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context2/Mistral 7b INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context4/Mistral 7b INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context8/Mistral 7b INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context16/Mistral 7b INST/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv')
-                  ]
-
-    context = [0, 1, 2, 4, 8, 16]
-    total_acc = []
-    anaphoric_acc = []
-    implicit_acc = []
-    explicit_acc = []
-    for c, pp, emma in zip(context, pp_paths, emma_paths):
-        count_alias_present_pp, \
-            total_count_pp, \
-            anaphoric_correct_count_pp, \
-            anaphoric_count_pp, \
-            implicit_correct_count_pp, \
-            implicit_count_pp, \
-            explicit_correct_count_pp, \
-            explicit_count_pp = analyze(*pp, strong_metric)
-
-        count_alias_present_emma, \
-            total_count_emma, \
-            anaphoric_correct_count_emma, \
-            anaphoric_count_emma, \
-            implicit_correct_count_emma, \
-            implicit_count_emma, \
-            explicit_correct_count_emma, \
-            explicit_count_emma = analyze(*emma, strong_metric)
-        total = total_count_pp + total_count_emma
-        anaphoric_count = anaphoric_count_pp + anaphoric_count_emma
-        implicit_count = implicit_count_pp + implicit_count_emma
-        explicit_count = explicit_count_pp + explicit_count_emma
-
-        total_correct_count = count_alias_present_pp + count_alias_present_emma
-        anaphoric_correct_count = anaphoric_correct_count_pp + anaphoric_correct_count_emma
-        implicit_correct_count = implicit_correct_count_pp + implicit_correct_count_emma
-        explicit_correct_count = explicit_correct_count_pp + explicit_correct_count_emma
-
-        total_acc.append(total_correct_count / total * 100)
-        anaphoric_acc.append(anaphoric_correct_count / anaphoric_count * 100)
-        implicit_acc.append(implicit_correct_count / implicit_count * 100)
-        explicit_acc.append(explicit_correct_count / explicit_count * 100)
-
-    print(f'PP: total:{total_count_pp}, anaphoric:{anaphoric_count_pp}, implicit:{implicit_count_pp}, explicit:{explicit_count_pp}')
-    print(f'EMMA: total:{total_count_emma}, anaphoric:{anaphoric_count_emma}, implicit:{implicit_count_emma}, explicit:{explicit_count_emma}')
-    formatted_list = ["{:.1f}".format(num) for num in total_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in anaphoric_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in implicit_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in explicit_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-    print()
-
-    pp_paths = [('context0/Llama 7b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context1/Llama 7b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context2/Llama 7b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context4/Llama 7b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context8/Llama 7b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context16/Llama 7b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv')
-                ]
-    emma_paths = [('context0/Llama 7b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context1/Llama 7b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context2/Llama 7b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context4/Llama 7b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context8/Llama 7b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context16/Llama 7b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv')
-                  ]
-
-    context = [0, 1, 2, 4, 8, 16]
-    total_acc = []
-    anaphoric_acc = []
-    implicit_acc = []
-    explicit_acc = []
-    for c, pp, emma in zip(context, pp_paths, emma_paths):
-        count_alias_present_pp, \
-            total_count_pp, \
-            anaphoric_correct_count_pp, \
-            anaphoric_count_pp, \
-            implicit_correct_count_pp, \
-            implicit_count_pp, \
-            explicit_correct_count_pp, \
-            explicit_count_pp = analyze(*pp, strong_metric)
-
-        count_alias_present_emma, \
-            total_count_emma, \
-            anaphoric_correct_count_emma, \
-            anaphoric_count_emma, \
-            implicit_correct_count_emma, \
-            implicit_count_emma, \
-            explicit_correct_count_emma, \
-            explicit_count_emma = analyze(*emma, strong_metric)
-        total = total_count_pp + total_count_emma
-        anaphoric_count = anaphoric_count_pp + anaphoric_count_emma
-        implicit_count = implicit_count_pp + implicit_count_emma
-        explicit_count = explicit_count_pp + explicit_count_emma
-
-        total_correct_count = count_alias_present_pp + count_alias_present_emma
-        anaphoric_correct_count = anaphoric_correct_count_pp + anaphoric_correct_count_emma
-        implicit_correct_count = implicit_correct_count_pp + implicit_correct_count_emma
-        explicit_correct_count = explicit_correct_count_pp + explicit_correct_count_emma
-
-        total_acc.append(total_correct_count / total * 100)
-        anaphoric_acc.append(anaphoric_correct_count / anaphoric_count * 100)
-        implicit_acc.append(implicit_correct_count / implicit_count * 100)
-        explicit_acc.append(explicit_correct_count / explicit_count * 100)
-
-    print(
-        f'PP: total:{total_count_pp}, anaphoric:{anaphoric_count_pp}, implicit:{implicit_count_pp}, explicit:{explicit_count_pp}')
-    print(
-        f'EMMA: total:{total_count_emma}, anaphoric:{anaphoric_count_emma}, implicit:{implicit_count_emma}, explicit:{explicit_count_emma}')
-    formatted_list = ["{:.1f}".format(num) for num in total_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in anaphoric_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in implicit_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in explicit_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-    print()
-
-    pp_paths = [('context0/Llama 13b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context1/Llama 13b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context2/Llama 13b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context4/Llama 13b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context8/Llama 13b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv'),
-                ('context16/Llama 13b/PrideAndPrejudice.csv',
-                 'PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/character_info.csv')
-                ]
-    emma_paths = [('context0/Llama 13b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context1/Llama 13b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context2/Llama 13b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context4/Llama 13b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context8/Llama 13b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv'),
-                  ('context16/Llama 13b/Emma.csv',
-                   'Emma/quotation_info.csv',
-                   'Emma/character_info.csv')
-                  ]
-
-    context = [0, 1, 2, 4, 8, 16]
-    total_acc = []
-    anaphoric_acc = []
-    implicit_acc = []
-    explicit_acc = []
-    for c, pp, emma in zip(context, pp_paths, emma_paths):
-        count_alias_present_pp, \
-            total_count_pp, \
-            anaphoric_correct_count_pp, \
-            anaphoric_count_pp, \
-            implicit_correct_count_pp, \
-            implicit_count_pp, \
-            explicit_correct_count_pp, \
-            explicit_count_pp = analyze(*pp, strong_metric)
-
-        count_alias_present_emma, \
-            total_count_emma, \
-            anaphoric_correct_count_emma, \
-            anaphoric_count_emma, \
-            implicit_correct_count_emma, \
-            implicit_count_emma, \
-            explicit_correct_count_emma, \
-            explicit_count_emma = analyze(*emma, strong_metric)
-        total = total_count_pp + total_count_emma
-        anaphoric_count = anaphoric_count_pp + anaphoric_count_emma
-        implicit_count = implicit_count_pp + implicit_count_emma
-        explicit_count = explicit_count_pp + explicit_count_emma
-
-        total_correct_count = count_alias_present_pp + count_alias_present_emma
-        anaphoric_correct_count = anaphoric_correct_count_pp + anaphoric_correct_count_emma
-        implicit_correct_count = implicit_correct_count_pp + implicit_correct_count_emma
-        explicit_correct_count = explicit_correct_count_pp + explicit_correct_count_emma
-
-        total_acc.append(total_correct_count / total * 100)
-        anaphoric_acc.append(anaphoric_correct_count / anaphoric_count * 100)
-        implicit_acc.append(implicit_correct_count / implicit_count * 100)
-        explicit_acc.append(explicit_correct_count / explicit_count * 100)
-
-    print(
-        f'PP: total:{total_count_pp}, anaphoric:{anaphoric_count_pp}, implicit:{implicit_count_pp}, explicit:{explicit_count_pp}')
-    print(
-        f'EMMA: total:{total_count_emma}, anaphoric:{anaphoric_count_emma}, implicit:{implicit_count_emma}, explicit:{explicit_count_emma}')
-    formatted_list = ["{:.1f}".format(num) for num in total_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in anaphoric_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in implicit_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-
-    formatted_list = ["{:.1f}".format(num) for num in explicit_acc]
-    print(" & ".join(formatted_list) + " \\\\")
-    print()
 
+def main():
+    grid = run_grid(metric=strong_metric)
+    table = accuracy_table(grid)
+
+    for model, model_table in table.groupby('model'):
+        print(model)
+        model_grid = grid[(grid['model'] == model) & (grid['context'] == grid['context'].min())]
+        for novel, novel_grid in model_grid.groupby('novel'):
+            counts = dict(zip(novel_grid['quoteType'], novel_grid['total']))
+            print(f'{novel}: total:{counts["All"]}, anaphoric:{counts["Anaphoric"]}, '
+                  f'implicit:{counts["Implicit"]}, explicit:{counts["Explicit"]}')
+        for quote_type in ['All'] + QUOTE_TYPES:
+            accuracies = model_table[model_table['quoteType'] == quote_type].sort_values('context')['accuracy']
+            formatted_list = ["{:.1f}".format(num) for num in accuracies]
+            print(" & ".join(formatted_list) + " \\\\")
+        print()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import functools
+import ast
+import csv
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+import analysis
+import dataset
+from aliases import AliasMatcher
+from inference import FakeBackend, llama_context_prompt, run_inference
+from prefix_cache import StubPrefixBackend, prefix_schedule
+
+# (sentences in the novel, characters, aliases per character, models,
+# context sizes) for each synthetic corpus size; one quote every three
+# sentences
+SIZES = {
+    'small': (3000, 20, 3, 2, 3),
+    'medium': (12000, 80, 4, 4, 4),
+    'large': (48000, 320, 5, 8, 6),
+}
+WORDS = ['the', 'of', 'and', 'a', 'to', 'in', 'was', 'her', 'it', 'that', 'she', 'not', 'be', 'as', 'had',
+         'with', 'for', 'very', 'could', 'would', 'such', 'must', 'no', 'said', 'but', 'all', 'they']
+QUOTE_TYPES = ['Anaphoric', 'Implicit', 'Explicit']
+
+
+def make_corpus(directory, sentences, cast, aliases_per_character, seed=0):
+    # novel_text.txt, quotation_info.csv and character_info.csv shaped like
+    # the Austen data
+    rng = random.Random(seed)
+    names = [f'Character{index}' for index in range(cast)]
+    titles = ['Mr.', 'Miss', 'Mrs.', 'Lady', 'Sir'][:aliases_per_character - 1]
+    aliases = [{name} | {f'{title} {name}' for title in titles} for name in names]
+
+    text = []
+    length = 0
+    quotes = []
+    for index in range(sentences):
+        words = rng.choices(WORDS, k=rng.randint(5, 25))
+        sentence = ' '.join(words).capitalize() + '.'
+        if index % 3 == 2:
+            speaker = rng.randrange(cast)
+            start = length + 1
+            sentence = f'"{sentence}"'
+            quotes.append({'quoteID': f'Q{len(quotes)}', 'quoteByteSpans': str([[start, start + len(sentence) - 2]]),
+                           'speaker': names[speaker], 'quoteType': rng.choice(QUOTE_TYPES)})
+        if index % 40 == 39:
+            sentence += '\n'
+        text.append(sentence)
+        length += len(sentence) + 1
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'novel_text.txt'), 'w', newline='') as novel:
+        novel.write(' '.join(text))
+    with open(os.path.join(directory, 'quotation_info.csv'), 'w', newline='') as quotes_csv:
+        writer = csv.DictWriter(quotes_csv, fieldnames=['quoteID', 'quoteByteSpans', 'speaker', 'quoteType'],
+                                quoting=csv.QUOTE_ALL)
+        writer.writeheader()
+        writer.writerows(quotes)
+    with open(os.path.join(directory, 'character_info.csv'), 'w', newline='') as characters_csv:
+        writer = csv.writer(characters_csv)
+        writer.writerow(['Character ID', 'Main Name', 'Aliases', 'Gender', 'Category'])
+        for index, (name, character_aliases) in enumerate(zip(names, aliases)):
+            writer.writerow([index, name, str(character_aliases), 'F', 'minor'])
+    return [quote['speaker'] for quote in quotes], aliases
+
+
+def make_results(root, novel, speakers, aliases, models, contexts, seed=0):
+    # context<k>/<model>/<novel>.csv files with free-text generations
+    rng = random.Random(seed)
+    alias_pool = [alias for character_aliases in aliases for alias in character_aliases]
+    for context in [0, 1, 2, 4, 8, 16, 32][:contexts]:
+        for model in range(models):
+            directory = os.path.join(root, f'context{context}', f'Model {model}')
+            os.makedirs(directory, exist_ok=True)
+            generations = []
+            for speaker in speakers:
+                guess = speaker if rng.random() < 0.5 else rng.choice(alias_pool)
+                generations.append(rng.choice([guess, f'The speaker is {guess}.', f' {guess}\n\nThe quote is',
+                                               float('nan')]))
+            pd.DataFrame({'prompt_text': ['prompt'] * len(speakers), 'inferred_speaker': generations}).to_csv(
+                os.path.join(directory, f'{novel}.csv'), index=False)
+
+
+def measure(stage, size, items, function, setup=None):
+    # timed without tracemalloc, whose overhead on pure-Python stages would
+    # swamp the timing, then run again under it for the peak; setup runs
+    # before each pass to reset caches
+    if setup is not None:
+        setup()
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'stage': stage, 'size': size, 'items': items, 'seconds': seconds,
+            'items_per_second': items / seconds if seconds else float('inf'), 'peak_bytes': peak}
+
+
+def bench_corpus(root, novel, size, windows=(1, 2, 4, 8, 16)):
+    quote_path = os.path.join(root, novel, 'quotation_info.csv')
+    novel_path = os.path.join(root, novel, 'novel_text.txt')
+    character_path = os.path.join(root, novel, 'character_info.csv')
+    quote_spans = dataset.read_quote_spans(quote_path)
+    quotes = len(quote_spans)
+    # start without a cached sentence index so the stage includes building it
+    index_path = dataset.sentence_index_path(novel_path)
+
+    def remove_index():
+        if os.path.exists(index_path):
+            os.remove(index_path)
+    records = [measure('write_contexts', size, quotes * len(windows), lambda: dataset.write_contexts(
+        quote_path, novel_path, os.path.join(root, f'{novel}_context{{}}.csv'), windows=windows), remove_index)]
+
+    characters = pd.read_csv(character_path)
+    characters['Aliases'] = characters['Aliases'].apply(ast.literal_eval)
+    quote_info = pd.read_csv(quote_path)
+    result_paths = [path for name, _, _, path in analysis.discover_results(root) if name == novel]
+    tables = []
+    for path in result_paths:
+        results = pd.read_csv(path)
+        min_length = min(len(results), len(quote_info))
+        tables.append(pd.concat([results.iloc[:min_length], quote_info.iloc[:min_length]], axis=1))
+    results_info = pd.concat(tables, ignore_index=True)
+    outputs = list(results_info['inferred_speaker'])
+
+    matcher = AliasMatcher(characters)
+    records.append(measure('earliest_alias', size, len(outputs),
+                           lambda: [analysis.earliest_alias(matcher, output) for output in outputs]))
+    records.append(measure('strong_metric', size, len(results_info),
+                           lambda: analysis.strong_metric(characters, results_info)))
+    records.append(measure('weak_metric', size, len(results_info),
+                           lambda: analysis.weak_metric(characters, results_info)))
+    records.append(measure('grid', size, len(analysis.discover_results(root)), lambda: analysis.run_grid(root),
+                           analysis.references.clear))
+
+    quote_texts = pd.read_csv(os.path.join(root, f'{novel}_context{windows[-1]}.csv'))
+    prompts = [llama_context_prompt('quote', left, right) for left, right in
+               zip(quote_texts['left_context'], quote_texts['right_context'])]
+    records.append(measure('inference', size, len(prompts),
+                           lambda: run_inference(FakeBackend(seconds_per_token=1e-7), prompts, batch_size=16)))
+    # the stub checks every reused prefix state against its prompt
+    schedule = functools.partial(prefix_schedule, positions=[start for start, _ in quote_spans])
+    records.append(measure('prefix_cache', size, len(prompts),
+                           lambda: run_inference(StubPrefixBackend(block_size=16), prompts, batch_size=16,
+                                                 schedule=schedule)))
+    return records
+
+
+def bench_synthetic(size, seed=0):
+    sentences, cast, aliases_per_character, models, contexts = SIZES[size]
+    with tempfile.TemporaryDirectory() as root:
+        speakers, aliases = make_corpus(os.path.join(root, 'Synthetic'), sentences, cast, aliases_per_character, seed)
+        make_results(root, 'Synthetic', speakers, aliases, models, contexts, seed)
+        return bench_corpus(root, 'Synthetic', size)
+
+
+def bench_austen(root='.'):
+    # the real novels and results, with the generated context files kept out
+    # of the tree
+    records = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for novel in ['PrideAndPrejudice', 'Emma']:
+            os.makedirs(os.path.join(scratch, novel))
+            for name in ['novel_text.txt', 'quotation_info.csv', 'character_info.csv']:
+                os.symlink(os.path.abspath(os.path.join(root, novel, name)), os.path.join(scratch, novel, name))
+            for _, model, context, path in analysis.discover_results(root):
+                if path.endswith(f'{novel}.csv'):
+                    os.makedirs(os.path.join(scratch, f'context{context}', model), exist_ok=True)
+                    os.symlink(os.path.abspath(path), os.path.join(scratch, f'context{context}', model, f'{novel}.csv'))
+        for novel in ['PrideAndPrejudice', 'Emma']:
+            records += bench_corpus(scratch, novel, f'austen-{novel}')
+    return records
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def regressions(records, baseline, tolerance):
+    # records slower than the baseline run of the same stage and size by
+    # more than tolerance (0.25 = 25%)
+    expected = {(record['stage'], record['size']): record['seconds'] for record in baseline}
+    flagged = []
+    for record in records:
+        seconds = expected.get((record['stage'], record['size']))
+        if seconds is not None and record['seconds'] > seconds * (1 + tolerance):
+            flagged.append((record, seconds))
+    return flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dataset generation, scoring and inference.')
+    parser.add_argument('--sizes', nargs='*', default=['small', 'medium'], choices=list(SIZES))
+    parser.add_argument('--no-austen', action='store_true', help='skip the real Austen baseline')
+    parser.add_argument('--history', default='benchmark_history.jsonl')
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    records = []
+    for size in args.sizes:
+        records += bench_synthetic(size)
+    if not args.no_austen:
+        records += bench_austen()
+
+    run = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit()}
+    with open(args.history, 'a') as history:
+        for record in records:
+            history.write(json.dumps({**run, **record}) + '\n')
+    for record in records:
+        print(f"{record['stage']:>15} {record['size']:>24} {record['seconds']:9.3f}s "
+              f"{record['items_per_second']:12.1f}/s {record['peak_bytes'] / 2 ** 20:9.1f} MiB")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline:
+            json.dump(records, baseline, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline:
+            flagged = regressions(records, json.load(baseline), args.tolerance)
+        for record, seconds in flagged:
+            print(f"REGRESSION {record['stage']} {record['size']}: {record['seconds']:.3f}s vs {seconds:.3f}s")
+        if flagged:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
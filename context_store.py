@@ -0,0 +1,61 @@
+import mmap
+import numpy as np
+
+
+class ContextStore:
+    # Read side of dataset.write_context_store: the novel is memory-mapped
+    # once and contexts are sliced out of it on demand. The *_bytes methods
+    # return zero-copy views of the raw file; the str methods decode them
+    # with newlines flattened to spaces, as dataset.py does, and strip both
+    # contexts like write_budget_contexts. Sentences keep
+    # the novel's own spacing between them rather than the single space that
+    # write_contexts joins them with.
+
+    def __init__(self, novel_path, offsets_path):
+        self.novel_file = open(novel_path, 'rb')
+        self.novel = mmap.mmap(self.novel_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.novel)
+        self.offsets = np.load(offsets_path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        self.view.release()
+        self.novel.close()
+        self.novel_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def left_bytes(self, index):
+        left_start, quote_start, _, _, _ = self.offsets[index]
+        return self.view[left_start:quote_start]
+
+    def quote_bytes(self, index):
+        _, quote_start, quote_end, _, _ = self.offsets[index]
+        return self.view[quote_start:quote_end]
+
+    def right_bytes(self, index):
+        # write_context starts the right context one character past quote_end
+        _, _, _, right_start, right_end = self.offsets[index]
+        return self.view[right_start:right_end]
+
+    def decode(self, view):
+        return bytes(view).decode('utf-8').replace("\n", " ")
+
+    def left_context(self, index):
+        return self.decode(self.left_bytes(index)).strip()
+
+    def quote(self, index):
+        return self.decode(self.quote_bytes(index))
+
+    def right_context(self, index):
+        return self.decode(self.right_bytes(index)).strip()
+
+    def contexts(self):
+        for index in range(len(self)):
+            yield self.left_context(index), self.right_context(index)
@@ -1,15 +1,61 @@
+import argparse
 import csv
 import ast
+import codecs
+import hashlib
+import json
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from bisect import bisect_left, bisect_right
+import numpy as np
 import nltk.tokenize
-nltk.download('punkt')
+import instrumentation
+
+# Sentences re-tokenized on either side of a window so that punkt's boundary
+# decisions next to the cut point match the ones made on the full text.
+SENTENCE_MARGIN = 2
+
+# Bytes between the (character, byte) checkpoints that the streaming
+# extraction keeps for mapping character offsets into a memory-mapped novel.
+CHECKPOINT_BYTES = 1 << 16
+
+NOVELS = [('PrideAndPrejudice', 'PrideAndPrejudice'), ('Emma', 'Emma')]
+WINDOWS = (1, 2, 4, 8, 16)
+
+sentence_tokenizer = None
+
+
+def load_sentence_tokenizer():
+    # punkt_tab on nltk 3.8.2 and later, the pickled punkt model before
+    # that; either is downloaded only when it is missing
+    try:
+        from nltk.tokenize import PunktTokenizer
+    except ImportError:
+        resource, load = 'punkt', lambda: nltk.data.load('tokenizers/punkt/english.pickle')
+    else:
+        resource, load = 'punkt_tab', lambda: PunktTokenizer('english')
+    try:
+        nltk.data.find(f'tokenizers/{resource}')
+    except LookupError:
+        nltk.download(resource)
+    return load()
+
+
+def sent_tokenize(text):
+    # the tokenizer is built on first use and reused for the rest of the
+    # process, so each build worker loads it once
+    global sentence_tokenizer
+    if sentence_tokenizer is None:
+        sentence_tokenizer = load_sentence_tokenizer()
+    return sentence_tokenizer.tokenize(text)
 
 
 def write_quotes(quote_path, novel_path, output_csv_name):
-    with open(quote_path, 'r', newline='') as input_csv, \
+    with instrumentation.stage('write_quotes', output=output_csv_name), \
             open(novel_path, 'r', newline='') as novel, \
             open(output_csv_name, 'w', newline='') as quotes_csv:
-        reader = csv.DictReader(input_csv)
-
         fieldnames = ['quoteText']
         quotes = csv.DictWriter(quotes_csv, fieldnames=fieldnames)
         quotes.writeheader()
@@ -17,62 +63,323 @@ def write_quotes(quote_path, novel_path, output_csv_name):
         text = novel.read()
         text = text.replace("\n", " ")
 
-        for row in reader:
-            quote_byte_spans = ast.literal_eval(row.get('quoteByteSpans'))
-            start = quote_byte_spans[0][0] - 1
-            end = quote_byte_spans[-1][-1] + 1
+        quote_spans = read_quote_spans(quote_path)
+        for start, end in quote_spans:
             quote = text[start:end]
             quotes.writerow({'quoteText': quote})
+        instrumentation.count('quotes', len(quote_spans))
         print(f'Done {output_csv_name}')
 
 
+def sentence_index_path(novel_path):
+    return os.path.join(os.path.dirname(novel_path), 'sentence_spans.csv')
+
+
+def sentence_spans(text, lo=0, hi=None):
+    # sent_tokenize returns slices of the input, so each sentence can be
+    # located by scanning forward from the end of the previous one
+    hi = len(text) if hi is None else hi
+    spans = []
+    position = lo
+    for sentence in sent_tokenize(text[lo:hi]):
+        start = text.find(sentence, position)
+        position = start + len(sentence)
+        spans.append((start, position))
+    instrumentation.count('sentences_tokenized', len(spans))
+    return spans
+
+
+def build_sentence_index(text):
+    return sentence_spans(text)
+
+
+def load_sentence_index(novel_path, text):
+    index_path = sentence_index_path(novel_path)
+    if os.path.exists(index_path) and \
+            os.path.getmtime(index_path) >= os.path.getmtime(novel_path):
+        with open(index_path, 'r', newline='') as index_csv:
+            reader = csv.DictReader(index_csv)
+            spans = [(int(row['start']), int(row['end'])) for row in reader]
+    else:
+        with instrumentation.stage('sentence_index', novel=novel_path):
+            spans = build_sentence_index(text)
+        with open(index_path, 'w', newline='') as index_csv:
+            writer = csv.writer(index_csv)
+            writer.writerow(['start', 'end'])
+            writer.writerows(spans)
+    return [start for start, _ in spans], [end for _, end in spans]
+
+
+def left_spans(text, starts, start, context_window):
+    if context_window <= 0:
+        return sentence_spans(text, 0, start)
+    first = bisect_right(starts, start) - 1 - context_window - SENTENCE_MARGIN
+    lo = starts[first] if first > 0 else 0
+    return sentence_spans(text, lo, start)[-context_window:]
+
+
+def right_spans(text, ends, end, context_window):
+    last = bisect_left(ends, end) + context_window + SENTENCE_MARGIN
+    hi = ends[last] if last < len(ends) else len(text)
+    return sentence_spans(text, end, hi)[:context_window]
+
+
+def left_sentences(text, starts, start, context_window):
+    return [text[lo:hi] for lo, hi in left_spans(text, starts, start, context_window)]
+
+
+def right_sentences(text, ends, end, context_window):
+    return [text[lo:hi] for lo, hi in right_spans(text, ends, end, context_window)]
+
+
+def read_quote_spans(quote_path):
+    with open(quote_path, 'r', newline='') as input_csv:
+        spans = []
+        for row in csv.DictReader(input_csv):
+            quote_byte_spans = ast.literal_eval(row.get('quoteByteSpans'))
+            spans.append((quote_byte_spans[0][0] - 1, quote_byte_spans[-1][-1] + 1))
+    return spans
+
+
+def write_contexts(quote_path, novel_path, output_csv_format, windows=(1, 2, 4, 8, 16)):
+    # output_csv_format is filled in with each window, e.g. 'Emma_context{}.csv'
+    quote_spans = read_quote_spans(quote_path)
+    with open(novel_path, 'r', newline='') as novel:
+        text = novel.read()
+    text = text.replace("\n", " ")
+    starts, ends = load_sentence_index(novel_path, text)
+
+    # a window of 0 keeps the whole prefix, as sentences[-0:] does
+    widest_left = 0 if 0 in windows else max(windows)
+    widest_right = max(windows)
+
+    with ExitStack() as stack:
+        stack.enter_context(instrumentation.stage('write_contexts', output=output_csv_format))
+        writers = []
+        for window in windows:
+            context_csv = stack.enter_context(
+                open(output_csv_format.format(window), 'w', newline=''))
+            context = csv.DictWriter(context_csv, fieldnames=['left_context', 'right_context'])
+            context.writeheader()
+            writers.append(context)
+
+        for start, end in quote_spans:
+            left = left_sentences(text, starts, start, widest_left)
+            right = right_sentences(text, ends, end + 1, widest_right)
+            for window, context in zip(windows, writers):
+                context.writerow({'left_context': ' '.join(left[-window:]),
+                                  'right_context': ' '.join(right[:window])})
+        instrumentation.count('quotes', len(quote_spans))
+
+    for window in windows:
+        print(f'Done {output_csv_format.format(window)}')
+
+
 def write_context(quote_path, novel_path, output_csv_name, context_window=0):
-    with open(quote_path, 'r', newline='') as input_csv, \
-            open(novel_path, 'r', newline='') as novel, \
-            open(output_csv_name, 'w', newline='') as context_csv:
-        reader = csv.DictReader(input_csv)
+    write_contexts(quote_path, novel_path, output_csv_name.replace('{', '{{').replace('}', '}}'),
+                   windows=[context_window])
+
+
+def byte_offsets(text, offsets):
+    # character offsets into the decoded novel -> byte offsets into the file
+    if text.isascii():
+        return offsets
+    widths = np.fromiter((len(char.encode('utf-8')) for char in text), dtype=np.int64, count=len(text))
+    positions = np.concatenate([[0], np.cumsum(widths)])
+    return positions[offsets]
 
-        fieldnames = ['left_context', 'right_context']
-        context = csv.DictWriter(context_csv, fieldnames=fieldnames)
-        context.writeheader()
 
+def write_context_store(quote_path, novel_path, output_npy_format, windows=(1, 2, 4, 8, 16)):
+    # Same windows as write_contexts, stored as one (left_start, quote_start,
+    # quote_end, right_start, right_end) byte-offset row per quote for
+    # ContextStore to slice out of the memory-mapped novel. right_start is
+    # the character after quote_end, converted on its own since that
+    # character may take several bytes.
+    quote_spans = read_quote_spans(quote_path)
+    with open(novel_path, 'r', newline='') as novel:
         text = novel.read()
-        text = text.replace("\n", " ")
+    text = text.replace("\n", " ")
+    starts, ends = load_sentence_index(novel_path, text)
+
+    widest_left = 0 if 0 in windows else max(windows)
+    widest_right = max(windows)
+    offsets = np.zeros((len(windows), len(quote_spans), 5), dtype=np.int64)
+
+    for row, (start, end) in enumerate(quote_spans):
+        left = left_spans(text, starts, start, widest_left)
+        right = right_spans(text, ends, end + 1, widest_right)
+        right_start = min(end + 1, len(text))
+        for column, window in enumerate(windows):
+            window_left = left[-window:]
+            window_right = right[:window]
+            offsets[column, row] = (window_left[0][0] if window_left else start,
+                                    start,
+                                    end,
+                                    right_start,
+                                    max(window_right[-1][1], right_start) if window_right else right_start)
+
+    offsets = byte_offsets(text, offsets)
+    for column, window in enumerate(windows):
+        np.save(output_npy_format.format(window), offsets[column])
+        print(f'Done {output_npy_format.format(window)}')
+
+
+def novel_checkpoints(novel, every=CHECKPOINT_BYTES):
+    # (character offsets, byte offsets) at every `every` bytes of the UTF-8
+    # novel, decoded a block at a time; None when the novel is ASCII and the
+    # two offsets coincide
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    char_offsets, byte_offsets = [0], [0]
+    chars = 0
+    for position in range(0, len(novel), every):
+        block = novel[position:position + every]
+        chars += len(decoder.decode(block, final=position + every >= len(novel)))
+        pending = len(decoder.getstate()[0])
+        char_offsets.append(chars)
+        byte_offsets.append(position + len(block) - pending)
+    if chars == len(novel):
+        return None
+    return char_offsets, byte_offsets
+
+
+def char_to_byte(novel, checkpoints, char):
+    if checkpoints is None:
+        return char
+    char_offsets, byte_offsets = checkpoints
+    index = bisect_right(char_offsets, char) - 1
+    remaining = char - char_offsets[index]
+    start = byte_offsets[index]
+    decoded = novel[start:start + 4 * remaining].decode('utf-8', errors='ignore')
+    return start + len(decoded[:remaining].encode('utf-8'))
+
+
+def write_quotes_streaming(quote_path, novel_path, output_csv_name):
+    # write_quotes over a memory-mapped novel: only the quote being written
+    # is decoded and has its newlines flattened
+    with instrumentation.stage('write_quotes', output=output_csv_name), \
+            open(novel_path, 'rb') as novel_file, \
+            mmap.mmap(novel_file.fileno(), 0, access=mmap.ACCESS_READ) as novel, \
+            open(quote_path, 'r', newline='') as input_csv, \
+            open(output_csv_name, 'w', newline='') as quotes_csv:
+        checkpoints = novel_checkpoints(novel)
+        quotes = csv.DictWriter(quotes_csv, fieldnames=['quoteText'])
+        quotes.writeheader()
 
-        for row in reader:
+        for row in csv.DictReader(input_csv):
             quote_byte_spans = ast.literal_eval(row.get('quoteByteSpans'))
-            start = quote_byte_spans[0][0] - 1
-            end = quote_byte_spans[-1][-1] + 1
+            start = char_to_byte(novel, checkpoints, quote_byte_spans[0][0] - 1)
+            end = char_to_byte(novel, checkpoints, quote_byte_spans[-1][-1] + 1)
+            quote = novel[start:end].decode('utf-8').replace("\n", " ")
+            quotes.writerow({'quoteText': quote})
+            instrumentation.count('quotes')
+    print(f'Done {output_csv_name}')
+    return output_csv_name
 
-            left_sentences = nltk.sent_tokenize(text[0:start])
-            right_sentences = nltk.sent_tokenize(text[end+1:len(text)])
 
-            left_context = ' '.join(left_sentences[-context_window:])
-            right_context = ' '.join(right_sentences[:context_window])
-            context.writerow({'left_context': left_context, 'right_context': right_context})
-        print(f'Done {output_csv_name}')
+def read_manifest(manifest_path):
+    # a CSV with a directory column (holding novel_text.txt and
+    # quotation_info.csv) and an optional name column for the output files
+    with open(manifest_path, 'r', newline='') as manifest_csv:
+        novels = []
+        for row in csv.DictReader(manifest_csv):
+            directory = os.path.join(os.path.dirname(manifest_path), row['directory'])
+            name = row.get('name') or os.path.basename(os.path.normpath(directory))
+            novels.append((name, directory))
+    return novels
+
+
+def write_quotes_manifest(manifest_path, output_dir='.', processes=None):
+    # quotes only, always rewritten; build_manifest also builds the contexts
+    # and skips up-to-date outputs
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(os.path.join(directory, 'quotation_info.csv'),
+             os.path.join(directory, 'novel_text.txt'),
+             os.path.join(output_dir, f'{name}_quotes.csv'))
+            for name, directory in read_manifest(manifest_path)]
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(write_quotes_streaming, *zip(*jobs)))
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_outputs(target, name, output_dir, windows):
+    if target == 'quotes':
+        return [os.path.join(output_dir, f'{name}_quotes.csv')]
+    return [os.path.join(output_dir, f'{name}_context{window}.csv') for window in windows]
+
+
+def build_target(job):
+    # one output set of one novel, skipped when the sources hash the same as
+    # at the last build and the outputs are still the files it wrote;
+    # returns (key, state entry, whether it was rebuilt)
+    key, target, name, directory, output_dir, windows, previous = job
+    quote_path = os.path.join(directory, 'quotation_info.csv')
+    novel_path = os.path.join(directory, 'novel_text.txt')
+    outputs = build_outputs(target, name, output_dir, windows)
+    sources = [file_digest(quote_path), file_digest(novel_path)] + ([] if target == 'quotes' else [list(windows)])
+    if previous is not None and previous['sources'] == sources and \
+            all(os.path.exists(path) and file_digest(path) == previous['outputs'].get(path) for path in outputs):
+        return key, previous, False
+
+    if target == 'quotes':
+        write_quotes_streaming(quote_path, novel_path, outputs[0])
+    else:
+        write_contexts(quote_path, novel_path, os.path.join(output_dir, f'{name}_context{{}}.csv'), windows)
+    return key, {'sources': sources, 'outputs': {path: file_digest(path) for path in outputs}}, True
+
+
+def build_corpus(novels, output_dir='.', windows=WINDOWS, processes=None, state_path=None):
+    # quotes and context CSVs for every (name, directory) in novels, one
+    # output set per worker. Hashes of the sources and outputs are kept in
+    # state_path, so a repeated build only redoes novels whose
+    # quotation_info.csv or novel_text.txt changed or whose outputs are
+    # missing or were modified. Returns the keys that were rebuilt.
+    state_path = state_path or os.path.join(output_dir, 'dataset_build.json')
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = []
+    for name, directory in novels:
+        for target in ['quotes', 'contexts']:
+            key = f'{name}/{target}'
+            jobs.append((key, target, name, directory, output_dir, list(windows), state.get(key)))
+    rebuilt = []
+    with ProcessPoolExecutor(processes) as pool:
+        for future in as_completed([pool.submit(build_target, job) for job in jobs]):
+            key, entry, built = future.result()
+            state[key] = entry
+            if built:
+                rebuilt.append(key)
+            # saved after every output set so an interrupted build resumes
+            with open(state_path, 'w') as state_file:
+                json.dump(state, state_file, indent=2, sort_keys=True)
+    return sorted(rebuilt)
+
+
+def build_manifest(manifest_path, output_dir='.', windows=WINDOWS, processes=None, state_path=None):
+    return build_corpus(read_manifest(manifest_path), output_dir, windows, processes, state_path)
 
 
 def main():
-    write_quotes('PrideAndPrejudice/quotation_info.csv',
-                 'PrideAndPrejudice/novel_text.txt',
-                 'PrideAndPrejudice_quotes.csv')
-
-    # for i in [1, 2, 4, 8, 16]:
-    #     write_context('PrideAndPrejudice/quotation_info.csv',
-    #                   'PrideAndPrejudice/novel_text.txt',
-    #                   f'PrideAndPrejudice_context{i}.csv',
-    #                   context_window=i)
-
-    write_quotes('Emma/quotation_info.csv',
-                 'Emma/novel_text.txt',
-                 'Emma_quotes.csv')
-
-    # for i in [1, 2, 4, 8, 16]:
-    #     write_context('Emma/quotation_info.csv',
-    #                   'Emma/novel_text.txt',
-    #                   f'Emma_context{i}.csv',
-    #                   context_window=i)
+    parser = argparse.ArgumentParser(description='Build the quote and context CSVs of every novel.')
+    parser.add_argument('--manifest', help='CSV with name,directory columns; defaults to the two Austen novels')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--windows', nargs='*', type=int, default=list(WINDOWS))
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args()
+
+    novels = NOVELS if args.manifest is None else read_manifest(args.manifest)
+    rebuilt = build_corpus(novels, args.output_dir, args.windows, args.processes)
+    print(f'Rebuilt {len(rebuilt)} of {2 * len(novels)} output sets')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+import re
+import pandas as pd
+from analysis import QUOTE_TYPES, earliest_alias, load_reference
+import instrumentation
+from stats import bootstrap_counts
+
+METRICS = ['strong', 'weak']
+
+
+class StreamingEvaluator:
+    # Running strong and weak correct/total counts per quoteType for one
+    # novel, updated as generations arrive instead of once the results CSV
+    # is complete. Each record costs one alias scan and one regex search; a
+    # quote submitted again replaces its earlier outcome.
+
+    def __init__(self, quotes_path, character_path, replicates=10000, confidence=0.95, seed=0):
+        self.characters = load_reference(quotes_path, character_path).characters
+        quote_info = pd.read_csv(quotes_path, usecols=['quoteID', 'speaker', 'quoteType'])
+        # quote_ids[i] is the quote of row i, the order prompts are built in
+        self.quote_ids = list(quote_info['quoteID'])
+        self.quotes = dict(zip(quote_info['quoteID'], zip(quote_info['speaker'], quote_info['quoteType'])))
+        # the weak metric's per-speaker pattern, as in weak_correct
+        self.patterns = {main_name: re.compile('|'.join(re.escape(alias) for alias in aliases))
+                         for main_name, aliases in zip(self.characters.names, self.characters.aliases) if aliases}
+        self.replicates = replicates
+        self.confidence = confidence
+        self.seed = seed
+        self.outcomes = {}
+        self.total = {quote_type: 0 for quote_type in ['All'] + QUOTE_TYPES}
+        self.correct = {(metric, quote_type): 0 for metric in METRICS for quote_type in self.total}
+
+    def __len__(self):
+        return self.total['All']
+
+    def count(self, quote_type, outcome, sign):
+        for key in {'All', quote_type}:
+            self.total[key] = self.total.get(key, 0) + sign
+            for metric, correct in zip(METRICS, outcome):
+                self.correct[metric, key] = self.correct.get((metric, key), 0) + sign * correct
+
+    def update(self, quote_id, inferred_speaker):
+        # (strong, weak) correctness of one generation
+        speaker, quote_type = self.quotes[quote_id]
+        if quote_id in self.outcomes:
+            self.count(quote_type, self.outcomes[quote_id], -1)
+        strong = earliest_alias(self.characters, inferred_speaker) == speaker
+        pattern = self.patterns.get(speaker)
+        weak = not isinstance(inferred_speaker, float) and pattern is not None \
+            and pattern.search(inferred_speaker) is not None
+        self.outcomes[quote_id] = (strong, weak)
+        self.count(quote_type, (strong, weak), 1)
+        return strong, weak
+
+    def update_many(self, quote_ids, inferred_speakers):
+        outcomes = [self.update(quote_id, inferred_speaker)
+                    for quote_id, inferred_speaker in zip(quote_ids, inferred_speakers)]
+        instrumentation.count('generations_scored', len(outcomes))
+        return outcomes
+
+    def accuracy(self, metric='strong', quote_type='All'):
+        # percent, NaN before any quote of quote_type
+        total = self.total.get(quote_type, 0)
+        return self.correct.get((metric, quote_type), 0) / total * 100 if total else float('nan')
+
+    def interval(self, metric='strong', quote_type='All'):
+        # (accuracy, low, high) in percent, as bootstrap_accuracy
+        return bootstrap_counts(self.correct.get((metric, quote_type), 0), self.total.get(quote_type, 0),
+                                self.replicates, self.confidence, self.seed)
+
+    def should_stop(self, width=None, below=None, metric='strong', quote_type='All', min_quotes=50):
+        # True once the interval is at most width points wide, or lies
+        # entirely under below (e.g. the best accuracy seen in the sweep).
+        # The interval only describes the whole cell when the quotes scored
+        # so far are a random sample of it, so run with random_schedule: the
+        # default length_schedule starts with the shortest prompts.
+        if self.total.get(quote_type, 0) < min_quotes:
+            return False
+        _, low, high = self.interval(metric, quote_type)
+        return (width is not None and high - low <= width) or (below is not None and high < below)
+
+    def counts(self, metric='strong'):
+        # the 8-tuple of count_correct for the quotes scored so far
+        values = [self.correct[metric, 'All'], self.total['All']]
+        for quote_type in QUOTE_TYPES:
+            values += [self.correct[metric, quote_type], self.total[quote_type]]
+        return tuple(values)
+
+    def summary(self):
+        rows = []
+        for metric in METRICS:
+            for quote_type in ['All'] + QUOTE_TYPES:
+                accuracy, low, high = self.interval(metric, quote_type)
+                rows.append({'metric': metric, 'quoteType': quote_type,
+                             'correct': self.correct[metric, quote_type], 'n': self.total[quote_type],
+                             'accuracy': accuracy, 'low': low, 'high': high})
+        return pd.DataFrame(rows)
+
+    def on_batch(self, quote_ids=None, stop=None):
+        # run_inference callback scoring every finished batch; quote_ids[i]
+        # is the quote of prompt i (row order by default) and stop(self)
+        # decides whether the run can end early. With stop, pass
+        # schedule=random_schedule() to run_inference, e.g.
+        #   run_inference(backend, prompts, schedule=random_schedule(),
+        #                 on_batch=evaluator.on_batch(stop=lambda e: e.should_stop(width=5)))
+        quote_ids = self.quote_ids if quote_ids is None else quote_ids
+
+        def score(indices, generations):
+            self.update_many([quote_ids[index] for index in indices], generations)
+            return stop is not None and stop(self)
+        return score
@@ -0,0 +1,75 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import pandas as pd
+
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+def generation_key(model_id, prompt, params):
+    params_text = json.dumps(params, sort_keys=True)
+    return hashlib.sha256('\0'.join([model_id, prompt_hash(prompt), params_text]).encode('utf-8')).hexdigest()
+
+
+class GenerationCache:
+    # Generations keyed by (model id, prompt hash, generation params) in a
+    # local SQLite file. Every put is committed straight away, so a crashed
+    # sweep resumes from the last finished batch.
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS generations ('
+            'key TEXT PRIMARY KEY, model_id TEXT, prompt_hash TEXT, params TEXT, generation TEXT)')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM generations').fetchone()[0]
+
+    def get_many(self, model_id, prompts, params):
+        # {index in prompts: generation} for every prompt already cached
+        keys = [generation_key(model_id, prompt, params) for prompt in prompts]
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.connection.execute(
+                f'SELECT key, generation FROM generations WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+            found.update(rows)
+        return {index: found[key] for index, key in enumerate(keys) if key in found}
+
+    def put_many(self, model_id, prompts, generations, params):
+        params_text = json.dumps(params, sort_keys=True)
+        rows = [(generation_key(model_id, prompt, params), model_id, prompt_hash(prompt), params_text, generation)
+                for prompt, generation in zip(prompts, generations)]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?)', rows)
+
+    def import_results(self, results_path, model_id, params):
+        # seed from a prompt_text,inferred_speaker CSV written by the notebook
+        results = pd.read_csv(results_path, keep_default_na=False)
+        self.put_many(model_id, list(results['prompt_text']), list(results['inferred_speaker']), params)
+        return len(results)
+
+    def import_results_tree(self, root, params, model_ids=None):
+        # every context*/<model>/<novel>.csv under root; model_ids maps the
+        # model directory name to the model id used as the cache key
+        model_ids = model_ids or {}
+        imported = 0
+        for results_path in sorted(glob.glob(os.path.join(root, 'context*', '*', '*.csv'))):
+            model = os.path.basename(os.path.dirname(results_path))
+            imported += self.import_results(results_path, model_ids.get(model, model), params)
+        return imported
@@ -0,0 +1,324 @@
+import random
+import time
+from collections import namedtuple
+from aliases import AliasMatcher
+import instrumentation
+
+
+def llama_prompt(quote):
+    return f"OUTPUT THE NAME OF THE CHARACTER WHO SAID:\n'{quote}'\n\nOnly give me the speaker’s name and nothing else. Please do NOT include the quote in the response."
+
+
+def mistral_prompt(quote):
+    return f"[INST]\n{llama_prompt(quote)}\n[/INST]"
+
+
+def llama_context_prompt(quote, left, right):
+    return f"CONTEXT:\n'{left} {quote} {right}'\n\nGIVEN CONTEXT, {llama_prompt(quote)}"
+
+
+def mistral_context_prompt(quote, left, right):
+    return f"[INST]\n{llama_context_prompt(quote, left, right)}\n[/INST]"
+
+
+# prompts/s and generated tokens/s over one run_inference call;
+# padding_ratio is the share of prompt positions in each batch that were
+# padding and cached counts prompts answered from a GenerationCache
+Throughput = namedtuple('Throughput', ['prompts', 'seconds', 'prompt_tokens', 'generated_tokens',
+                                       'padding_ratio', 'prompts_per_second', 'tokens_per_second',
+                                       'cached'])
+
+
+class PipelineBackend:
+    # Hugging Face text-generation pipeline, run a batch at a time
+
+    def __init__(self, model, **pipeline_kwargs):
+        import torch
+        from transformers import AutoTokenizer
+        from transformers.pipelines import pipeline
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        self.tokenizer.pad_token = self.tokenizer.eos_token
+        # decoder-only models continue from the last position, so pad on the left
+        self.tokenizer.padding_side = 'left'
+        pipeline_kwargs.setdefault('device_map', 'auto')
+        pipeline_kwargs.setdefault('torch_dtype', torch.bfloat16)
+        pipeline_kwargs.setdefault('model_kwargs', {'low_cpu_mem_usage': True})
+        self.pipe = pipeline(task='text-generation', model=model, tokenizer=self.tokenizer, **pipeline_kwargs)
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def generate(self, prompts, max_new_tokens):
+        sequences = self.pipe(
+            prompts,
+            batch_size=len(prompts),
+            return_full_text=False,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=self.tokenizer.eos_token_id,
+        )
+        return [''.join(out['generated_text'] for out in outs) for outs in sequences]
+
+    def close(self):
+        import gc
+        import torch
+
+        del self.pipe
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+class FakeBackend:
+    # Deterministic stand-in for CPU-only runs: tokens are whitespace-split
+    # words and respond(prompt) supplies the generation.
+
+    def __init__(self, respond=lambda prompt: 'Elizabeth', seconds_per_token=0.0):
+        self.respond = respond
+        self.seconds_per_token = seconds_per_token
+        self.batches = []
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def generate(self, prompts, max_new_tokens):
+        self.batches.append(len(prompts))
+        outputs = [' '.join(self.respond(prompt).split()[:max_new_tokens]) for prompt in prompts]
+        if self.seconds_per_token:
+            longest = max(self.count_tokens(prompt) for prompt in prompts)
+            time.sleep(self.seconds_per_token * longest * len(prompts))
+        return outputs
+
+    def close(self):
+        pass
+
+
+def bucket_prompts(lengths, batch_size):
+    # batches of prompt indices with similar token lengths, so each batch
+    # pads to a length close to that of its shortest prompt
+    order = sorted(range(len(lengths)), key=lambda index: lengths[index])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def length_schedule(prompts, lengths, batch_size, indices=None):
+    return bucket_prompts(lengths, batch_size)
+
+
+def random_schedule(seed=0):
+    # schedule running the prompts in a shuffled order, so every prefix of
+    # the run is a random sample of them; needed whenever on_batch judges
+    # the run by the outputs seen so far, as StreamingEvaluator.should_stop
+    # does. Batches pad to their longest prompt.
+    def schedule(prompts, lengths, batch_size, indices=None):
+        order = list(range(len(prompts)))
+        random.Random(seed).shuffle(order)
+        return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    return schedule
+
+
+def run_inference(backend, prompts, batch_size=8, max_new_tokens=100, progress=None,
+                  cache=None, model_id=None, schedule=length_schedule, on_batch=None):
+    # Returns the generations in prompt order and a Throughput record.
+    # progress, e.g. tqdm, wraps the batch iterator. With a GenerationCache,
+    # prompts already answered by model_id are skipped and every finished
+    # batch is stored before the next one starts. schedule(prompts, lengths,
+    # batch_size, indices) picks the batches, by token length unless
+    # overridden; it sees only the prompts still to run, and indices holds
+    # their positions in the full prompt list.
+    # on_batch(indices, generations) sees the cached prompts first and then
+    # every finished batch; a true return stops the run, leaving the
+    # remaining outputs None. A backend's params dict, e.g. its decoding
+    # mode, is part of the cache key.
+    start_time = time.perf_counter()
+    params = {'max_new_tokens': max_new_tokens, **getattr(backend, 'params', {})}
+    outputs = [None] * len(prompts)
+    if cache is not None:
+        for index, generation in cache.get_many(model_id, prompts, params).items():
+            outputs[index] = generation
+    pending = [index for index, output in enumerate(outputs) if output is None]
+    stopped = False
+    if on_batch is not None and len(pending) < len(prompts):
+        cached = [index for index, output in enumerate(outputs) if output is not None]
+        stopped = bool(on_batch(cached, [outputs[index] for index in cached]))
+
+    lengths = [backend.count_tokens(prompts[index]) for index in pending]
+    batches = [[pending[position] for position in batch]
+               for batch in schedule([prompts[index] for index in pending], lengths, batch_size, pending)]
+    lengths = dict(zip(pending, lengths))
+    if progress is not None:
+        batches = progress(batches)
+
+    padded_tokens = 0
+    generated_tokens = 0
+    with instrumentation.stage('generate', model=model_id):
+        for batch in batches:
+            if stopped:
+                break
+            batch_prompts = [prompts[index] for index in batch]
+            generations = backend.generate(batch_prompts, max_new_tokens)
+            if cache is not None:
+                cache.put_many(model_id, batch_prompts, generations, params)
+            padded_tokens += max(lengths[index] for index in batch) * len(batch)
+            for index, generation in zip(batch, generations):
+                outputs[index] = generation
+                generated_tokens += backend.count_tokens(generation)
+            if on_batch is not None:
+                stopped = bool(on_batch(batch, generations))
+        instrumentation.count('prompts', len(pending))
+        instrumentation.count('cache_hits', len(prompts) - len(pending))
+        instrumentation.count('prompt_tokens', sum(lengths.values()))
+        instrumentation.count('tokens_generated', generated_tokens)
+
+    seconds = time.perf_counter() - start_time
+    prompt_tokens = sum(lengths.values())
+    throughput = Throughput(
+        prompts=len(prompts),
+        seconds=seconds,
+        prompt_tokens=prompt_tokens,
+        generated_tokens=generated_tokens,
+        padding_ratio=1 - prompt_tokens / padded_tokens if padded_tokens else 0.0,
+        prompts_per_second=len(prompts) / seconds if seconds else float('inf'),
+        tokens_per_second=generated_tokens / seconds if seconds else float('inf'),
+        cached=len(prompts) - len(pending),
+    )
+    return outputs, throughput
+
+
+class AliasTrie:
+    # Token-level trie over every alias of a novel's characters. encode turns
+    # text into token ids; each alias is added once per prefix, since models
+    # usually answer with a leading space or newline.
+
+    def __init__(self, characters, encode, prefixes=('', ' ')):
+        if not isinstance(characters, AliasMatcher):
+            characters = AliasMatcher(characters)
+        # nodes map token id -> child; the None key holds the Main Name of an
+        # alias ending at that node
+        self.root = {}
+        self.depth = 0
+        for main_name, aliases in zip(characters.names, characters.aliases):
+            for alias in aliases:
+                for prefix in prefixes:
+                    self.add(encode(prefix + alias), main_name)
+
+    def add(self, token_ids, main_name):
+        node = self.root
+        for token_id in token_ids:
+            node = node.setdefault(token_id, {})
+        # an alias shared by several characters keeps the first one, as
+        # earliest_alias does
+        node.setdefault(None, main_name)
+        self.depth = max(self.depth, len(token_ids))
+
+    def walk(self, token_ids):
+        node = self.root
+        for token_id in token_ids:
+            node = node.get(token_id)
+            if node is None:
+                return None
+        return node
+
+    def name(self, token_ids):
+        node = self.walk(token_ids)
+        return None if node is None else node.get(None)
+
+    def allowed(self, token_ids, eos_token_id):
+        # next tokens that keep the output on an alias; eos once one is complete
+        node = self.walk(token_ids)
+        if node is None:
+            return [eos_token_id]
+        allowed = [token_id for token_id in node if token_id is not None]
+        if None in node:
+            allowed.append(eos_token_id)
+        return allowed
+
+
+def alias_stop(text, aliases, terminators='\n.,;:!?"\''):
+    # True once text holds a full alias followed by a terminator
+    for alias in aliases:
+        start = text.find(alias)
+        while start != -1:
+            end = start + len(alias)
+            if end < len(text) and text[end] in terminators:
+                return True
+            start = text.find(alias, start + 1)
+    return False
+
+
+def greedy_trie_decode(next_token_scores, trie, eos_token_id, max_new_tokens):
+    # Greedy decoding restricted to the trie. next_token_scores(token_ids)
+    # returns a score per vocabulary id for the continuation of token_ids;
+    # ConstrainedBackend gets the same constraint from model.generate.
+    generated = []
+    for _ in range(max_new_tokens):
+        scores = next_token_scores(generated)
+        token_id = max(trie.allowed(generated, eos_token_id), key=lambda allowed: scores[allowed])
+        if token_id == eos_token_id:
+            break
+        generated.append(token_id)
+    return generated
+
+
+class ConstrainedBackend:
+    # Causal LM that either only emits character aliases (mode='trie') or
+    # generates freely but stops once an alias and a terminator appear
+    # (mode='stop'). Works with run_inference like PipelineBackend.
+
+    def __init__(self, model, characters, mode='trie', **model_kwargs):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.torch = torch
+        self.mode = mode
+        # keeps the generations of each mode apart in a GenerationCache
+        self.params = {'decoding': mode}
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = 'left'
+        model_kwargs.setdefault('device_map', 'auto')
+        model_kwargs.setdefault('torch_dtype', torch.bfloat16)
+        self.model = AutoModelForCausalLM.from_pretrained(model, **model_kwargs)
+        if not isinstance(characters, AliasMatcher):
+            characters = AliasMatcher(characters)
+        self.aliases = [alias for aliases in characters.aliases for alias in aliases]
+        self.trie = AliasTrie(characters, lambda text: self.tokenizer(text, add_special_tokens=False)['input_ids'],
+                              prefixes=('', ' ', '\n'))
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def generate(self, prompts, max_new_tokens):
+        from transformers import StoppingCriteria, StoppingCriteriaList
+
+        inputs = self.tokenizer(prompts, return_tensors='pt', padding=True).to(self.model.device)
+        prompt_length = inputs['input_ids'].shape[1]
+        eos_token_id = self.tokenizer.eos_token_id
+        kwargs = {}
+        if self.mode == 'trie':
+            kwargs['prefix_allowed_tokens_fn'] = lambda batch_id, input_ids: self.trie.allowed(
+                input_ids[prompt_length:].tolist(), eos_token_id)
+            max_new_tokens = min(max_new_tokens, self.trie.depth + 1)
+        else:
+            tokenizer = self.tokenizer
+            aliases = self.aliases
+            torch = self.torch
+
+            class AliasStoppingCriteria(StoppingCriteria):
+                def __call__(self, input_ids, scores, **criteria_kwargs):
+                    texts = tokenizer.batch_decode(input_ids[:, prompt_length:], skip_special_tokens=True)
+                    return torch.tensor([alias_stop(text, aliases) for text in texts], device=input_ids.device)
+
+            kwargs['stopping_criteria'] = StoppingCriteriaList([AliasStoppingCriteria()])
+
+        with self.torch.no_grad():
+            outputs = self.model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                          pad_token_id=eos_token_id, **kwargs)
+        return self.tokenizer.batch_decode(outputs[:, prompt_length:], skip_special_tokens=True)
+
+    def close(self):
+        import gc
+
+        del self.model
+        gc.collect()
+        if self.torch.cuda.is_available():
+            self.torch.cuda.empty_cache()
@@ -0,0 +1,146 @@
+import atexit
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Opt-in timers and counters for the pipeline stages. Everything is a no-op
+# until enable() is called, or until the INSTRUMENT_TRACE environment
+# variable names an output file (.json for the summary, anything else for a
+# Chrome trace), which enables it at import and writes the file at exit.
+# INSTRUMENT_PROFILE and INSTRUMENT_MEMORY take comma-separated stage names
+# to run under cProfile or tracemalloc. Numbers are per process, so stages
+# run inside a process pool's workers are not included.
+
+enabled = False
+profile_stages = set()
+memory_stages = set()
+output_dir = '.'
+started = time.perf_counter()
+events = []
+stages = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'counters': defaultdict(int)})
+profilers = {}
+profiles = {}
+memory = {}
+local = threading.local()
+
+
+def enable(profile=(), memory_profile=(), directory='.'):
+    global enabled, profile_stages, memory_stages, output_dir
+    enabled = True
+    profile_stages = set(profile)
+    memory_stages = set(memory_profile)
+    output_dir = directory
+
+
+def reset():
+    events.clear()
+    stages.clear()
+    profilers.clear()
+    profiles.clear()
+    memory.clear()
+
+
+def current_stages():
+    if not hasattr(local, 'stack'):
+        local.stack = []
+    return local.stack
+
+
+@contextmanager
+def stage(name, **args):
+    if not enabled:
+        yield
+        return
+    stack = current_stages()
+    stack.append(name)
+    # one profiler per stage name, so repeated calls add up in its .prof file
+    profiler = profilers.setdefault(name, cProfile.Profile()) if name in profile_stages else None
+    tracing = name in memory_stages and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            path = os.path.join(output_dir, f'{name}.prof')
+            profiler.dump_stats(path)
+            profiles[name] = path
+        if tracing:
+            snapshot = tracemalloc.take_snapshot()
+            memory[name] = {
+                'peak_bytes': tracemalloc.get_traced_memory()[1],
+                'top': [str(statistic) for statistic in snapshot.statistics('lineno')[:10]],
+            }
+            tracemalloc.stop()
+        stack.pop()
+        record = stages[name]
+        record['calls'] += 1
+        record['seconds'] += seconds
+        events.append({'name': name, 'ph': 'X', 'ts': (start - started) * 1e6, 'dur': seconds * 1e6,
+                       'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+
+
+def count(name, value=1):
+    # adds to a counter of the innermost running stage
+    if not enabled:
+        return
+    stack = current_stages()
+    stages[stack[-1] if stack else 'unstaged']['counters'][name] += value
+
+
+def summary():
+    result = {}
+    for name, record in stages.items():
+        seconds = record['seconds']
+        result[name] = {
+            'calls': record['calls'],
+            'seconds': seconds,
+            'counters': dict(record['counters']),
+            'rates': {f'{counter}_per_second': value / seconds
+                      for counter, value in record['counters'].items() if seconds},
+        }
+    return {'stages': result, 'profiles': dict(profiles), 'memory': dict(memory)}
+
+
+def export_json(path):
+    with open(path, 'w') as output:
+        json.dump(summary(), output, indent=2)
+
+
+def export_chrome_trace(path):
+    # load in chrome://tracing or Perfetto; counters are attached as the
+    # final values of each stage
+    counters = [{'name': name, 'ph': 'C', 'ts': (time.perf_counter() - started) * 1e6, 'pid': os.getpid(),
+                 'args': dict(record['counters'])}
+                for name, record in stages.items() if record['counters']]
+    with open(path, 'w') as output:
+        json.dump({'traceEvents': events + counters, 'displayTimeUnit': 'ms'}, output)
+
+
+def export(path):
+    if path.endswith('.json') and not path.endswith('.trace.json'):
+        export_json(path)
+    else:
+        export_chrome_trace(path)
+
+
+def split_stages(value):
+    return [name for name in value.split(',') if name]
+
+
+if os.environ.get('INSTRUMENT_TRACE'):
+    trace_path = os.environ['INSTRUMENT_TRACE']
+    enable(profile=split_stages(os.environ.get('INSTRUMENT_PROFILE', '')),
+           memory_profile=split_stages(os.environ.get('INSTRUMENT_MEMORY', '')),
+           directory=os.path.dirname(os.path.abspath(trace_path)))
+    atexit.register(export, trace_path)
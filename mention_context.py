@@ -0,0 +1,145 @@
+import ast
+import csv
+import re
+from bisect import bisect_left, bisect_right
+import numpy as np
+import pandas as pd
+from dataset import load_sentence_index, read_quote_spans
+from token_budget import TokenIndex
+
+# Characters searched on either side of a quote for its referringExpression,
+# which quotation_info stores without punctuation or line breaks.
+ATTRIBUTION_CHARS = 300
+
+
+def expression_pattern(expression):
+    # 'said Mr Bennet' matches 'said Mr. Bennet' and a line break between
+    # words, but 'said she' does not match 'said shepherd'
+    return re.compile(r'\b' + r'\W+'.join(re.escape(word) for word in re.findall(r'\w+', expression)) + r'\b')
+
+
+def locate_expression(text, start, end, expression):
+    # span of the occurrence of expression nearest to text[start:end], or None
+    if not isinstance(expression, str) or not re.search(r'\w', expression):
+        return None
+    lo = max(0, start - ATTRIBUTION_CHARS)
+    best = None
+    for match in expression_pattern(expression).finditer(text, lo, end + ATTRIBUTION_CHARS):
+        distance = max(start - match.end(), match.start() - end, 0)
+        if best is None or distance < best[0]:
+            best = distance, match.span()
+    return None if best is None else best[1]
+
+
+def evidence_spans(quote_info, text, aliases):
+    # spans that can identify a speaker: mentions of a character by one of
+    # its names (not pronouns) and the referring expressions of attributed
+    # quotes, e.g. 'said his lady to him'
+    spans = []
+    for texts, mention_spans in zip(quote_info['mentionTextsList'], quote_info['mentionSpansList']):
+        for mention_texts, quote_mention_spans in zip(ast.literal_eval(texts), ast.literal_eval(mention_spans)):
+            # mentions keep the novel's line breaks ('Mr.\nKnightley')
+            spans += [tuple(span) for mention, span in zip(mention_texts, quote_mention_spans)
+                      if mention.replace("\n", " ") in aliases]
+    for quote_byte_spans, expression in zip(quote_info['quoteByteSpans'], quote_info['referringExpression']):
+        quote_byte_spans = ast.literal_eval(quote_byte_spans)
+        span = locate_expression(text, quote_byte_spans[0][0] - 1, quote_byte_spans[-1][-1] + 1, expression)
+        if span is not None:
+            spans.append(span)
+    return spans
+
+
+class EvidenceIndex:
+    # Evidence spans sorted by start and, separately, by end, so the spans
+    # nearest to either side of a quote are binary searches instead of a
+    # scan over every mention in the novel.
+
+    def __init__(self, spans):
+        spans = np.asarray(sorted(set(spans)), dtype=np.int64).reshape(-1, 2)
+        self.starts = spans[:, 0]
+        self.start_ends = spans[:, 1]
+        by_end = np.argsort(spans[:, 1], kind='stable')
+        self.ends = spans[by_end, 1]
+        self.end_starts = spans[by_end, 0]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def before(self, start, count=1):
+        # earliest start among the count spans ending last at or before
+        # start, or None
+        stop = int(np.searchsorted(self.ends, start, side='right'))
+        if stop == 0:
+            return None
+        return int(self.end_starts[max(0, stop - count):stop].min())
+
+    def after(self, end, count=1):
+        # latest end among the count spans starting first at or after end,
+        # or None
+        first = int(np.searchsorted(self.starts, end, side='left'))
+        if first == len(self):
+            return None
+        return int(self.start_ends[first:first + count].max())
+
+
+def mention_window(evidence, start, end, limit_start, limit_end, count=1):
+    # (left_start, right_end) of the smallest window around text[start:end]
+    # holding the count nearest evidence spans on each side, cut to the
+    # budget window (limit_start, limit_end); a side without evidence gets
+    # no context
+    left_start = evidence.before(start, count)
+    right_end = evidence.after(end, count)
+    left_start = start if left_start is None else max(left_start, limit_start)
+    right_end = end if right_end is None else min(right_end, limit_end)
+    return left_start, right_end
+
+
+def widen_to_sentences(sentence_starts, sentence_ends, start, end, left_start, right_end,
+                       limit_start, limit_end):
+    # grows a window out to the sentences its ends fall in, where that stays
+    # within the budget window
+    if left_start < start:
+        first = bisect_right(sentence_starts, left_start) - 1
+        if first >= 0 and sentence_starts[first] >= limit_start:
+            left_start = sentence_starts[first]
+    if right_end > end:
+        last = bisect_left(sentence_ends, right_end)
+        if last < len(sentence_ends) and sentence_ends[last] <= limit_end:
+            right_end = sentence_ends[last]
+    return left_start, right_end
+
+
+def write_mention_contexts(quote_path, novel_path, character_path, output_csv_format, budgets=(64, 128, 256, 512),
+                           count=1, tokenizer=None, left_share=0.5, snap=False):
+    # write_budget_contexts, but each side only reaches as far as the count
+    # nearest named mentions or attribution phrases, so most prompts are
+    # shorter than the budget. The evidence comes from the annotations, so
+    # these contexts show how much of the budget the cues need rather than
+    # a selection available to an unannotated novel.
+    quote_spans = read_quote_spans(quote_path)
+    quote_info = pd.read_csv(quote_path, usecols=['quoteByteSpans', 'referringExpression', 'mentionTextsList',
+                                                  'mentionSpansList'])
+    characters = pd.read_csv(character_path)
+    aliases = set().union(*characters['Aliases'].apply(ast.literal_eval))
+    with open(novel_path, 'r', newline='') as novel:
+        text = novel.read()
+    text = text.replace("\n", " ")
+    evidence = EvidenceIndex(evidence_spans(quote_info, text, aliases))
+    tokens = TokenIndex.from_words(text) if tokenizer is None else TokenIndex.from_tokenizer(text, tokenizer)
+    if snap:
+        sentence_starts, sentence_ends = load_sentence_index(novel_path, text)
+
+    for budget in budgets:
+        with open(output_csv_format.format(budget), 'w', newline='') as context_csv:
+            context = csv.DictWriter(context_csv, fieldnames=['left_context', 'right_context'])
+            context.writeheader()
+            for start, end in quote_spans:
+                # the right context starts one character past end, as in write_contexts
+                limit_start, limit_end = tokens.budget_window(start, end + 1, budget, left_share)
+                left_start, right_end = mention_window(evidence, start, end + 1, limit_start, limit_end, count)
+                if snap:
+                    left_start, right_end = widen_to_sentences(sentence_starts, sentence_ends, start, end + 1,
+                                                               left_start, right_end, limit_start, limit_end)
+                context.writerow({'left_context': text[left_start:start].strip(),
+                                  'right_context': text[end + 1:right_end].strip()})
+        print(f'Done {output_csv_format.format(budget)}')
@@ -0,0 +1,208 @@
+import copy
+from collections import OrderedDict
+
+
+class PrefixCache:
+    # LRU of model states (key/value caches) for prompt prefixes cut at
+    # multiples of block_size tokens. Every block boundary of a stored prompt
+    # is indexed by a chained hash of its blocks, mapping to every live entry
+    # that contains that prefix, so a later prompt finds an entry sharing its
+    # longest block-aligned prefix and the backend crops that entry's state
+    # to the shared length. The least recently used entries are evicted once
+    # budget_bytes is exceeded, and dropped from the index with them.
+
+    def __init__(self, budget_bytes, block_size=32):
+        self.budget_bytes = budget_bytes
+        self.block_size = block_size
+        self.entries = OrderedDict()
+        self.index = {}
+        self.used_bytes = 0
+        self.lookups = 0
+        self.hits = 0
+        self.tokens_seen = 0
+        self.tokens_saved = 0
+
+    def block_hashes(self, token_ids, limit):
+        # (prefix length, hash) for every block boundary up to limit tokens
+        hashes = []
+        chained = 0
+        for end in range(self.block_size, limit + 1, self.block_size):
+            chained = hash((chained, tuple(token_ids[end - self.block_size:end])))
+            hashes.append((end, chained))
+        return hashes
+
+    def lookup(self, token_ids):
+        # (shared prefix length, stored state) for the longest cached prefix
+        # that leaves at least one token to feed the model, or (0, None).
+        # The stored state may be longer than the shared prefix.
+        self.lookups += 1
+        self.tokens_seen += len(token_ids)
+        length, key = 0, None
+        for end, block_hash in self.block_hashes(token_ids, len(token_ids) - 1):
+            candidates = self.index.get(block_hash)
+            if not candidates:
+                break
+            # the most recently stored entry with this prefix
+            length, key = end, next(reversed(candidates))
+        if key is None or self.entries[key][0][:length] != tuple(token_ids[:length]):
+            return 0, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.tokens_saved += length
+        return length, self.entries[key][1]
+
+    def store(self, token_ids, state, nbytes):
+        if not token_ids or len(token_ids) % self.block_size or nbytes > self.budget_bytes:
+            return
+        hashes = self.block_hashes(token_ids, len(token_ids))
+        key = hashes[-1][1]
+        if key in self.entries:
+            self.used_bytes -= self.entries.pop(key)[2]
+        self.entries[key] = (tuple(token_ids), state, nbytes)
+        self.used_bytes += nbytes
+        for _, block_hash in hashes:
+            candidates = self.index.setdefault(block_hash, {})
+            candidates.pop(key, None)
+            candidates[key] = None
+        while self.used_bytes > self.budget_bytes:
+            evicted, (evicted_tokens, _, evicted_bytes) = self.entries.popitem(last=False)
+            self.used_bytes -= evicted_bytes
+            for _, block_hash in self.block_hashes(evicted_tokens, len(evicted_tokens)):
+                candidates = self.index.get(block_hash)
+                if candidates is not None:
+                    candidates.pop(evicted, None)
+                    if not candidates:
+                        del self.index[block_hash]
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'used_bytes': self.used_bytes,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'tokens_saved': self.tokens_saved,
+            'tokens_saved_ratio': self.tokens_saved / self.tokens_seen if self.tokens_seen else 0.0,
+        }
+
+
+def prefix_schedule(prompts, lengths, batch_size, indices=None, positions=None):
+    # run_inference schedule that keeps prompts sharing a prefix next to each
+    # other: sorted by novel position when given, otherwise lexicographically.
+    # positions follows the full prompt list, e.g.
+    # functools.partial(prefix_schedule, positions=quote_starts), and indices
+    # maps the prompts still to run back into it.
+    if positions is None:
+        order = sorted(range(len(prompts)), key=lambda index: prompts[index])
+    else:
+        indices = range(len(prompts)) if indices is None else indices
+        order = sorted(range(len(prompts)), key=lambda index: (positions[indices[index]], prompts[index]))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+class PrefixCachedBackend:
+    # Causal LM run one prompt at a time, reusing the key/value state of the
+    # longest cached prefix and caching the state at the prompt's last block
+    # boundary for the prompts that follow.
+
+    def __init__(self, model, budget_bytes=2 ** 30, block_size=32, **model_kwargs):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        model_kwargs.setdefault('device_map', 'auto')
+        model_kwargs.setdefault('torch_dtype', torch.bfloat16)
+        self.model = AutoModelForCausalLM.from_pretrained(model, **model_kwargs)
+        self.cache = PrefixCache(budget_bytes, block_size)
+
+    def encode(self, text):
+        return self.tokenizer(text)['input_ids']
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def crop(self, state, length):
+        # copy of state holding only the first length tokens
+        if hasattr(state, 'crop'):
+            state = copy.deepcopy(state)
+            state.crop(length)
+            return state
+        return tuple((key[:, :, :length], value[:, :, :length]) for key, value in state)
+
+    def prefill(self, token_ids, start, state):
+        # feeds token_ids[start:] on top of state (the first start tokens);
+        # returns the extended state and its size in bytes
+        torch = self.torch
+        input_ids = torch.tensor([token_ids[start:]], device=self.model.device)
+        with torch.no_grad():
+            outputs = self.model(input_ids=input_ids, past_key_values=state, use_cache=True)
+        past = outputs.past_key_values
+        layers = past.to_legacy_cache() if hasattr(past, 'to_legacy_cache') else past
+        nbytes = sum(tensor.numel() * tensor.element_size() for layer in layers for tensor in layer)
+        return past, nbytes
+
+    def continue_generation(self, token_ids, state, max_new_tokens):
+        torch = self.torch
+        input_ids = torch.tensor([token_ids], device=self.model.device)
+        with torch.no_grad():
+            outputs = self.model.generate(input_ids=input_ids, past_key_values=state,
+                                          max_new_tokens=max_new_tokens, do_sample=False,
+                                          pad_token_id=self.tokenizer.eos_token_id)
+        return self.tokenizer.decode(outputs[0, len(token_ids):], skip_special_tokens=True)
+
+    def generate(self, prompts, max_new_tokens):
+        generations = []
+        for prompt in prompts:
+            token_ids = self.encode(prompt)
+            cached_length, stored = self.cache.lookup(token_ids)
+            state = None if stored is None else self.crop(stored, cached_length)
+            boundary = (len(token_ids) - 1) // self.cache.block_size * self.cache.block_size
+            if boundary > cached_length:
+                state, nbytes = self.prefill(token_ids[:boundary], cached_length, state)
+                self.cache.store(token_ids[:boundary], state, nbytes)
+                state = self.crop(state, boundary)
+            generations.append(self.continue_generation(token_ids, state, max_new_tokens))
+        return generations
+
+    def close(self):
+        import gc
+
+        del self.model
+        self.cache.entries.clear()
+        gc.collect()
+        if self.torch.cuda.is_available():
+            self.torch.cuda.empty_cache()
+
+
+class StubPrefixBackend(PrefixCachedBackend):
+    # CPU stand-in for checking the caching without a model: tokens are
+    # whitespace-split words and a state is the tuple of token ids it was
+    # computed from, so every reused state is checked against the prompt it
+    # is used for. respond(token_ids) supplies the generation.
+
+    def __init__(self, budget_bytes=2 ** 20, block_size=32, respond=lambda token_ids: 'Elizabeth'):
+        self.cache = PrefixCache(budget_bytes, block_size)
+        self.respond = respond
+        self.vocabulary = {}
+
+    def encode(self, text):
+        return [self.vocabulary.setdefault(word, len(self.vocabulary)) for word in text.split()]
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def crop(self, state, length):
+        return state[:length]
+
+    def prefill(self, token_ids, start, state):
+        if start and state != tuple(token_ids[:start]):
+            raise AssertionError(f'reused state does not match the first {start} prompt tokens')
+        # 8 bytes per token stands in for the key/value tensors
+        return tuple(token_ids), 8 * len(token_ids)
+
+    def continue_generation(self, token_ids, state, max_new_tokens):
+        if state is not None and state != tuple(token_ids[:len(state)]):
+            raise AssertionError('generation state does not match the prompt')
+        return self.respond(token_ids)
+
+    def close(self):
+        self.cache.entries.clear()
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from analysis import QUOTE_TYPES, count_correct, discover_results, load_reference, strong_metric
+
+# One Parquet dataset per store, partitioned by novel/model/context, with a
+# row per quote. Prompts live once in prompts.parquet and results refer to
+# them by prompt_id.
+PARTITIONS = ['novel', 'model', 'context']
+
+
+def prompt_id(prompt_text):
+    return int.from_bytes(hashlib.sha256(prompt_text.encode('utf-8')).digest()[:8], 'little', signed=True)
+
+
+def import_results_tree(root, store_dir):
+    # every context<k>/<model>/<novel>.csv under root, paired by position
+    # with <novel>/quotation_info.csv as analyze does
+    frames = []
+    prompts = {}
+    for novel, model, context, results_path in discover_results(root):
+        results = pd.read_csv(results_path)
+        quote_info = pd.read_csv(os.path.join(root, novel, 'quotation_info.csv'),
+                                 usecols=['quoteID', 'speaker', 'quoteType'])
+        min_length = min(len(results), len(quote_info))
+        ids = [prompt_id(prompt_text) for prompt_text in results['prompt_text'].iloc[:min_length]]
+        prompts.update(zip(ids, results['prompt_text'].iloc[:min_length]))
+        frame = quote_info.iloc[:min_length].copy()
+        frame['inferred_speaker'] = results['inferred_speaker'].iloc[:min_length].to_numpy()
+        frame['prompt_id'] = ids
+        frame['novel'] = novel
+        frame['model'] = model
+        frame['context'] = context
+        frames.append(frame)
+
+    table = pa.Table.from_pandas(pd.concat(frames, ignore_index=True), preserve_index=False)
+    pq.write_to_dataset(table, os.path.join(store_dir, 'results'), partition_cols=PARTITIONS,
+                        existing_data_behavior='delete_matching')
+    prompt_table = pa.table({'prompt_id': list(prompts), 'prompt_text': list(prompts.values())})
+    pq.write_table(prompt_table, os.path.join(store_dir, 'prompts.parquet'))
+    return table.num_rows
+
+
+def load_results(store_dir, columns=('inferred_speaker', 'speaker', 'quoteType'), **partition_values):
+    # the requested columns, plus the partition keys, for the cells matching
+    # partition_values, e.g. load_results(store, model='Llama 7b', context=8)
+    dataset = ds.dataset(os.path.join(store_dir, 'results'), format='parquet', partitioning='hive')
+    condition = None
+    for name, value in partition_values.items():
+        term = ds.field(name) == value
+        condition = term if condition is None else condition & term
+    columns = list(dict.fromkeys(PARTITIONS + list(columns)))
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+def load_prompts(store_dir, prompt_ids=None):
+    prompts = pq.read_table(os.path.join(store_dir, 'prompts.parquet')).to_pandas()
+    if prompt_ids is not None:
+        prompts = prompts[prompts['prompt_id'].isin(prompt_ids)]
+    return prompts.set_index('prompt_id')['prompt_text']
+
+
+def score_store(store_dir, root='.', metric=strong_metric, **partition_values):
+    # the same long table as analysis.run_grid, read from the store
+    results = load_results(store_dir, **partition_values)
+    rows = []
+    for (novel, model, context), results_info in results.groupby(PARTITIONS, sort=True, observed=True):
+        reference = load_reference(os.path.join(root, novel, 'quotation_info.csv'),
+                                   os.path.join(root, novel, 'character_info.csv'))
+        counts = [int(count) for count in count_correct(metric(reference.characters,
+                                                               results_info.reset_index(drop=True)))]
+        for quote_type, (correct, total) in zip(['All'] + QUOTE_TYPES, zip(counts[::2], counts[1::2])):
+            rows.append({'novel': novel, 'model': model, 'context': int(context), 'quoteType': quote_type,
+                         'correct': correct, 'total': total})
+    return pd.DataFrame(rows)
@@ -0,0 +1,114 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from analysis import QUOTE_TYPES, discover_results, score_table, strong_metric
+
+# Resampling n quotes with replacement only matters through how many of
+# them fall in each outcome, so a replicate is one binomial (or, for paired
+# cells, multinomial) draw and thousands of replicates are a single numpy
+# call, with the same distribution as resampling quote indices.
+
+
+def bootstrap_accuracy(correct, replicates=10000, confidence=0.95, seed=0):
+    # (accuracy, low, high) in percent
+    correct = np.asarray(correct, dtype=bool)
+    return bootstrap_counts(int(correct.sum()), len(correct), replicates, confidence, seed)
+
+
+def bootstrap_counts(correct, n, replicates=10000, confidence=0.95, seed=0):
+    # bootstrap_accuracy from the number correct out of n
+    if n == 0:
+        return float('nan'), float('nan'), float('nan')
+    rng = np.random.default_rng(seed)
+    accuracy = correct / n
+    samples = rng.binomial(n, accuracy, size=replicates) / n
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(samples, [tail, 1 - tail])
+    return accuracy * 100, low * 100, high * 100
+
+
+def paired_bootstrap(correct_a, correct_b, replicates=10000, confidence=0.95, seed=0):
+    # accuracy of a minus b on the same quotes, in percent: (difference, low,
+    # high, two-sided p-value for no difference)
+    correct_a = np.asarray(correct_a, dtype=bool)
+    correct_b = np.asarray(correct_b, dtype=bool)
+    n = len(correct_a)
+    if n == 0:
+        return float('nan'), float('nan'), float('nan'), float('nan')
+    only_a = np.sum(correct_a & ~correct_b)
+    only_b = np.sum(~correct_a & correct_b)
+    rng = np.random.default_rng(seed)
+    counts = rng.multinomial(n, [only_a / n, only_b / n, 1 - (only_a + only_b) / n], size=replicates)
+    samples = (counts[:, 0] - counts[:, 1]) / n
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(samples, [tail, 1 - tail])
+    p_value = min(1.0, 2 * min(np.mean(samples <= 0), np.mean(samples >= 0)))
+    return (only_a - only_b) / n * 100, low * 100, high * 100, p_value
+
+
+def mcnemar(correct_a, correct_b, exact_below=25):
+    # (quotes only a got right, quotes only b got right, statistic, p-value);
+    # exact binomial test for few discordant quotes, otherwise chi-squared
+    # with continuity correction
+    correct_a = np.asarray(correct_a, dtype=bool)
+    correct_b = np.asarray(correct_b, dtype=bool)
+    only_a = int(np.sum(correct_a & ~correct_b))
+    only_b = int(np.sum(~correct_a & correct_b))
+    discordant = only_a + only_b
+    if discordant == 0:
+        return only_a, only_b, 0.0, 1.0
+    if discordant < exact_below:
+        tail = sum(math.comb(discordant, k) for k in range(min(only_a, only_b) + 1)) / 2 ** discordant
+        return only_a, only_b, float(min(only_a, only_b)), min(1.0, 2 * tail)
+    statistic = (abs(only_a - only_b) - 1) ** 2 / discordant
+    return only_a, only_b, statistic, math.erfc(math.sqrt(statistic / 2))
+
+
+def cell_tables(root='.', metric=strong_metric, models=None):
+    # {(model, context): per-quote table over every novel}, with the novel
+    # in a column so two cells can be paired quote by quote
+    tables = {}
+    for novel, model, context, results_path in discover_results(root):
+        if models is not None and model not in models:
+            continue
+        table = score_table(results_path, f'{root}/{novel}/quotation_info.csv',
+                            f'{root}/{novel}/character_info.csv', metric)
+        table = table[['quoteType', 'correct']].assign(novel=novel, position=np.arange(len(table)))
+        tables.setdefault((model, context), []).append(table)
+    return {cell: pd.concat(parts, ignore_index=True) for cell, parts in tables.items()}
+
+
+def bootstrap_cell(job):
+    (model, context), table, replicates, confidence, seed = job
+    rows = []
+    for quote_type in ['All'] + QUOTE_TYPES:
+        subset = table if quote_type == 'All' else table[table['quoteType'] == quote_type]
+        accuracy, low, high = bootstrap_accuracy(subset['correct'], replicates, confidence, seed)
+        rows.append({'model': model, 'context': context, 'quoteType': quote_type, 'n': len(subset),
+                     'accuracy': accuracy, 'low': low, 'high': high})
+    return rows
+
+
+def bootstrap_grid(tables, replicates=10000, confidence=0.95, seed=0, processes=None):
+    # confidence intervals for every cell of cell_tables, one cell per worker
+    jobs = [(cell, table, replicates, confidence, seed) for cell, table in sorted(tables.items())]
+    with ProcessPoolExecutor(processes) as pool:
+        return pd.DataFrame([row for rows in pool.map(bootstrap_cell, jobs) for row in rows])
+
+
+def compare_cells(table_a, table_b, replicates=10000, confidence=0.95, seed=0):
+    # paired bootstrap and McNemar between two cells on the quotes both
+    # scored, overall and per quoteType
+    paired = table_a.merge(table_b, on=['novel', 'position', 'quoteType'], suffixes=('_a', '_b'))
+    rows = []
+    for quote_type in ['All'] + QUOTE_TYPES:
+        subset = paired if quote_type == 'All' else paired[paired['quoteType'] == quote_type]
+        difference, low, high, bootstrap_p = paired_bootstrap(
+            subset['correct_a'], subset['correct_b'], replicates, confidence, seed)
+        only_a, only_b, statistic, mcnemar_p = mcnemar(subset['correct_a'], subset['correct_b'])
+        rows.append({'quoteType': quote_type, 'n': len(subset), 'difference': difference,
+                     'low': low, 'high': high, 'bootstrap_p': bootstrap_p,
+                     'only_a': only_a, 'only_b': only_b, 'mcnemar_statistic': statistic,
+                     'mcnemar_p': mcnemar_p})
+    return pd.DataFrame(rows)
@@ -0,0 +1,99 @@
+import csv
+import re
+from bisect import bisect_left, bisect_right
+import numpy as np
+from dataset import load_sentence_index, read_quote_spans
+
+WORD_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+
+class TokenIndex:
+    # Character spans of every token in a novel, computed once, so the token
+    # position of any character offset is a binary search instead of a walk
+    # over the token list like the notebook's find_xth_index.
+
+    def __init__(self, spans):
+        spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+        self.starts = spans[:, 0]
+        self.ends = spans[:, 1]
+
+    @classmethod
+    def from_words(cls, text):
+        return cls([match.span() for match in WORD_PATTERN.finditer(text)])
+
+    @classmethod
+    def from_tokenizer(cls, text, tokenizer):
+        # Hugging Face fast tokenizer; tokens are counted as the model sees them
+        offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+        return cls([span for span in offsets if span[1] > span[0]])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def token_at(self, char):
+        # index of the token covering char, or of the next token after it,
+        # which is also the number of tokens ending at or before char
+        return int(np.searchsorted(self.ends, char, side='right'))
+
+    def tokens_from(self, char):
+        # index of the first token that starts at or after char
+        return int(np.searchsorted(self.starts, char, side='left'))
+
+    def window(self, start, end, left_tokens, right_tokens):
+        # (left_start, right_end) character offsets of the widest context
+        # with at most left_tokens before start and right_tokens after end
+        before = self.token_at(start)
+        first = max(0, before - left_tokens)
+        left_start = int(self.starts[first]) if first < before else start
+        after = self.tokens_from(end)
+        last = min(len(self), after + right_tokens)
+        right_end = int(self.ends[last - 1]) if last > after else end
+        return left_start, right_end
+
+    def budget_window(self, start, end, budget, left_share=0.5):
+        # splits budget tokens between the two sides, left_share of it on the
+        # left, and gives whatever one side cannot use (near the start or end
+        # of the novel) to the other
+        before = self.token_at(start)
+        after = len(self) - self.tokens_from(end)
+        left_tokens = min(before, int(round(budget * left_share)))
+        right_tokens = min(after, budget - left_tokens)
+        left_tokens = min(before, budget - right_tokens)
+        return self.window(start, end, left_tokens, right_tokens)
+
+
+def snap_to_sentences(sentence_starts, sentence_ends, start, end, left_start, right_end):
+    # shrinks a window to whole sentences: the left side begins at a sentence
+    # start and the right side ends at a sentence end
+    first = bisect_left(sentence_starts, left_start)
+    left_start = sentence_starts[first] if first < len(sentence_starts) and sentence_starts[first] <= start else start
+    last = bisect_right(sentence_ends, right_end) - 1
+    right_end = sentence_ends[last] if last >= 0 and sentence_ends[last] >= end else end
+    return left_start, right_end
+
+
+def write_budget_contexts(quote_path, novel_path, output_csv_format, budgets=(64, 128, 256, 512),
+                          tokenizer=None, left_share=0.5, snap=False):
+    # write_contexts by token budget instead of sentence count; each quote
+    # gets the widest context within the budget, optionally whole sentences
+    quote_spans = read_quote_spans(quote_path)
+    with open(novel_path, 'r', newline='') as novel:
+        text = novel.read()
+    text = text.replace("\n", " ")
+    tokens = TokenIndex.from_words(text) if tokenizer is None else TokenIndex.from_tokenizer(text, tokenizer)
+    if snap:
+        sentence_starts, sentence_ends = load_sentence_index(novel_path, text)
+
+    for budget in budgets:
+        with open(output_csv_format.format(budget), 'w', newline='') as context_csv:
+            context = csv.DictWriter(context_csv, fieldnames=['left_context', 'right_context'])
+            context.writeheader()
+            for start, end in quote_spans:
+                # the right context starts one character past end, as in write_contexts
+                left_start, right_end = tokens.budget_window(start, end + 1, budget, left_share)
+                if snap:
+                    left_start, right_end = snap_to_sentences(sentence_starts, sentence_ends,
+                                                              start, end + 1, left_start, right_end)
+                context.writerow({'left_context': text[left_start:start].strip(),
+                                  'right_context': text[end + 1:right_end].strip()})
+        print(f'Done {output_csv_format.format(budget)}')